@@ -0,0 +1,403 @@
+"""Benchmarks for the MQTT to UDP bridge.
+
+    python mqtt_udp_bench.py topic-index     # index lookup cost vs mapping count
+    python mqtt_udp_bench.py startup         # cold-start time, headless vs GUI
+    python mqtt_udp_bench.py throughput      # end-to-end on_message -> UDP scenarios
+    python mqtt_udp_bench.py sharding        # throughput vs number of shard processes
+    python mqtt_udp_bench.py config-load     # bridge start with and without the config snapshot
+    python mqtt_udp_bench.py                 # all of the above except sharding and config-load
+
+Throughput results are also written as JSON (--output) so releases can be
+compared.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from mqtt_udp_core import BridgeCore, TopicIndex, topic_matches
+from mqtt_udp_shards import ShardBridge
+
+
+def make_topics(count, wildcard_ratio=0.05, seed=1):
+    """Build Advantech-style topic filters, a fraction of them with wildcards"""
+    rng = random.Random(seed)
+    topics = []
+    for i in range(count):
+        device = f"{i // 16:012X}"
+        topic = f"Advantech/{device}/cfg/sensor/di_value/di{i % 16}"
+        roll = rng.random()
+        if roll < wildcard_ratio / 2:
+            topic = f"Advantech/{device}/cfg/sensor/+/di{i % 16}"
+        elif roll < wildcard_ratio:
+            topic = f"Advantech/{device}/cfg/#"
+        topics.append(topic)
+    return topics
+
+
+def concrete_topic(pattern):
+    """A topic published by a device that the filter pattern matches"""
+    return pattern.replace('+', 'di_value').replace('#', 'sensor/di_value/di0')
+
+
+def time_per_call(func, topics, min_time=0.2):
+    """Average seconds per call of func over topics, repeating for at least min_time"""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for topic in topics:
+            func(topic)
+        calls += len(topics)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+
+
+def bench_topic_index(sizes=(10, 100, 1000, 10000, 100000), linear_limit=10000):
+    """Compare TopicIndex lookups with the old linear scan over every mapping"""
+    print(f"{'mappings':>10} {'build ms':>10} {'index us':>10} {'linear us':>10}")
+    for size in sizes:
+        filters = make_topics(size)
+        mappings = [{'topic': t} for t in filters]
+        lookups = [concrete_topic(t) for t in random.Random(2).sample(filters, min(size, 200))]
+
+        start = time.perf_counter()
+        index = TopicIndex((m['topic'], m) for m in mappings)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        index_us = time_per_call(index.match, lookups) * 1e6
+
+        linear = '-'
+        if size <= linear_limit:
+            def scan(topic):
+                return [m for m in mappings if topic_matches(m['topic'], topic)]
+            linear = f"{time_per_call(scan, lookups[:20], min_time=0.1) * 1e6:.1f}"
+
+        print(f"{size:>10} {build_ms:>10.1f} {index_us:>10.2f} {linear:>10}")
+
+
+def bench_startup(repeats=10):
+    """Cold-start cost of the headless and GUI entry points (interpreter + imports)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    scenarios = {
+        'python only': "pass",
+        'headless': "import mqtt_udp, mqtt_udp_core",
+        'gui': "import mqtt_udp, mqtt_udp_gui",
+    }
+    print(f"{'startup':>12} {'best ms':>10} {'median ms':>10}")
+    for name, code in scenarios.items():
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=here, check=True)
+            times.append((time.perf_counter() - start) * 1000)
+        times.sort()
+        print(f"{name:>12} {times[0]:>10.1f} {times[len(times) // 2]:>10.1f}")
+
+
+class ParsingBridge(BridgeCore):
+    """BridgeCore that always parses and indexes its config, without snapshots"""
+
+    def load_snapshot(self, digest):
+        return False
+
+    def write_snapshot(self, digest):
+        pass
+
+
+def bench_config_load(sizes=(10000, 100000)):
+    """Time BridgeCore construction from a large config: parsed and indexed, then from its snapshot"""
+    print(f"{'mappings':>10} {'parse s':>10} {'snapshot s':>10}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'mappings.json')
+            with open(path, 'w') as f:
+                json.dump(bench_config(make_topics(size), 9, 1), f)
+            times = []
+            for bridge_class in (ParsingBridge, BridgeCore, BridgeCore):
+                start = time.perf_counter()
+                bridge = bridge_class(path)
+                times.append(time.perf_counter() - start)
+                bridge.shutdown()
+        # The first BridgeCore wrote the snapshot the second one read
+        print(f"{size:>10} {times[0]:>10.2f} {times[2]:>10.2f}")
+
+
+# name -> settings for one end-to-end run (see run_scenario)
+SCENARIOS = {
+    'exact-plain': {'wildcard_ratio': 0.0, 'payload': 'plain', 'udp_delay': 0.0},
+    'exact-json': {'wildcard_ratio': 0.0, 'payload': 'json', 'udp_delay': 0.0},
+    'wildcard-plain': {'wildcard_ratio': 0.3, 'payload': 'plain', 'udp_delay': 0.0},
+    'wildcard-json': {'wildcard_ratio': 0.3, 'payload': 'json', 'udp_delay': 0.0},
+    'delayed-plain': {'wildcard_ratio': 0.0, 'payload': 'plain', 'udp_delay': 0.1},
+}
+
+PAYLOADS = {'plain': b'1', 'json': b'{"Val": 1, "Ts": "2024-01-01T00:00:00Z"}'}
+
+
+class FakeMessage:
+    """Stand-in for paho's MQTTMessage with the fields on_message reads"""
+
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class LatencyRecorder:
+    """Mixin for bridges that keeps every receive-to-send latency sample"""
+
+    def __init__(self, *args):
+        self.latencies = []
+        self.last_send = 0.0
+        super().__init__(*args)
+
+    def record_send(self, route, view, count=1):
+        super().record_send(route, view, count)
+        now = time.perf_counter()
+        self.latencies.append(now - view.received - route.mapping.get('udp_delay', 0.0))
+        self.last_send = now
+
+
+class BenchBridge(LatencyRecorder, BridgeCore):
+    pass
+
+
+class ShardBenchBridge(LatencyRecorder, ShardBridge):
+    pass
+
+
+class UDPSink:
+    """Counts datagrams arriving on a local UDP port"""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+        self.received = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                self.sock.recv(2048)
+                self.received += 1
+            except socket.timeout:
+                pass
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def bench_config(filters, port, workers, udp_delay=0.0):
+    """Mappings file contents sending every filter to 127.0.0.1:port"""
+    return {
+        'broker': {'address': 'localhost', 'port': 1883, 'auto_connect': False},
+        'sender': {'workers': workers, 'queue_size': 10000, 'overflow': 'block'},
+        'metrics': {'enabled': False},
+        'mappings': [{
+            'topic': topic,
+            'udp_ip': '127.0.0.1',
+            'udp_port': port,
+            'udp_message': 'SL.CTRL01-C.{payload}.GO',
+            'trigger_value': '1',
+            'udp_delay': udp_delay,
+        } for topic in filters],
+    }
+
+
+def run_scenario(name, mappings=1000, messages=20000, workers=4, timeout=60.0):
+    """Feed synthetic messages straight into on_message and measure the UDP output"""
+    settings = SCENARIOS[name]
+    sink = UDPSink()
+    filters = make_topics(mappings, settings['wildcard_ratio'])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'mappings.json')
+        with open(path, 'w') as f:
+            json.dump(bench_config(filters, sink.port, workers, settings['udp_delay']), f)
+        bridge = BenchBridge(path)
+
+    rng = random.Random(3)
+    payload = PAYLOADS[settings['payload']]
+    traffic = [FakeMessage(concrete_topic(rng.choice(filters)), payload) for _ in range(messages)]
+    expected = sum(len(bridge.topic_index.match(msg.topic)) for msg in traffic)
+
+    start = time.perf_counter()
+    for msg in traffic:
+        bridge.on_message(None, None, msg)
+    received_done = time.perf_counter()
+
+    deadline = start + timeout + settings['udp_delay']
+    while len(bridge.latencies) < expected and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = (bridge.last_send or time.perf_counter()) - start - settings['udp_delay']
+    time.sleep(0.2)  # Let the sink catch up
+
+    bridge.shutdown()
+    sink.close()
+    latencies = bridge.latencies
+    return {
+        'scenario': name,
+        'mappings': mappings,
+        'messages': messages,
+        'expected_sends': expected,
+        'sends': len(latencies),
+        'delivered': sink.received,
+        'receive_msgs_per_sec': round(messages / (received_done - start), 1),
+        'msgs_per_sec': round(messages / elapsed, 1) if elapsed > 0 else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        **settings,
+    }
+
+
+def bench_throughput(names=None, mappings=1000, messages=20000, workers=4, output='bench_results.json'):
+    """Run each scenario in a fresh interpreter (so peak RSS is per scenario) and save the results"""
+    names = names or list(SCENARIOS)
+    results = []
+    print(f"{'scenario':>16} {'msgs/s':>10} {'recv/s':>10} {'sends':>8} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8}")
+    for name in names:
+        args = json.dumps({'name': name, 'mappings': mappings, 'messages': messages, 'workers': workers})
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-scenario', args],
+                               check=True, capture_output=True, text=True)
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{name:>16} {result['msgs_per_sec']:>10} {result['receive_msgs_per_sec']:>10} "
+              f"{result['sends']:>8} {result['p50_ms']:>8} {result['p99_ms']:>8} {result['peak_rss_kb'] / 1024:>8.1f}")
+
+    if output:
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'revision': git_revision(),
+            'results': results,
+        }
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+    return results
+
+
+def run_shard(config, shard, shards, messages, start_at, timeout=60.0):
+    """One shard process of bench_sharding: route the share of the traffic the broker would deliver to it"""
+    bridge = ShardBenchBridge(config, shard, shards)
+    with open(config) as f:
+        filters = make_topics(len(json.load(f)['mappings']), 0.0)
+    rng = random.Random(3)
+    traffic = [FakeMessage(concrete_topic(rng.choice(filters)), PAYLOADS['plain']) for _ in range(messages)]
+    # The broker only delivers messages matching this shard's subscriptions
+    traffic = [msg for msg in traffic if bridge.topic_index.match(msg.topic)]
+
+    # Start together with the other shards
+    time.sleep(max(0.0, start_at - time.time()))
+    start = time.perf_counter()
+    for msg in traffic:
+        bridge.on_message(None, None, msg)
+    deadline = start + timeout
+    while len(bridge.latencies) < len(traffic) and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    finished = time.time() - (time.perf_counter() - (bridge.last_send or time.perf_counter()))
+    bridge.shutdown()
+    return {'shard': shard, 'messages': len(traffic), 'sends': len(bridge.latencies), 'finished': finished}
+
+
+def bench_sharding(shard_counts=(1, 2, 4), mappings=1000, messages=40000, workers=2):
+    """Aggregate throughput with the mappings split over 1..N shard processes"""
+    sink = UDPSink()
+    filters = make_topics(mappings, 0.0)
+    print(f"{'shards':>8} {'msgs/s':>10} {'speedup':>8} {'sends':>8}   ({os.cpu_count()} CPUs)")
+    baseline = None
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'mappings.json')
+        with open(path, 'w') as f:
+            json.dump(bench_config(filters, sink.port, workers), f)
+        for shards in shard_counts:
+            # Leave time for the interpreters to start and build their indexes
+            start_at = time.time() + 1.0 + 0.2 * shards
+            children = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run-shard',
+                                          json.dumps([path, shard, shards, messages, start_at])],
+                                         stdout=subprocess.PIPE, text=True)
+                        for shard in range(shards)]
+            reports = [json.loads(child.communicate()[0].strip().splitlines()[-1]) for child in children]
+            elapsed = max(r['finished'] for r in reports) - start_at
+            rate = sum(r['messages'] for r in reports) / elapsed
+            baseline = baseline or rate
+            results.append({'shards': shards, 'msgs_per_sec': round(rate, 1), 'speedup': round(rate / baseline, 2)})
+            print(f"{shards:>8} {rate:>10.0f} {rate / baseline:>8.2f} {sum(r['sends'] for r in reports):>8}")
+    sink.close()
+    return results
+
+
+def git_revision():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=here,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MQTT to UDP bridge benchmarks")
+    parser.add_argument('bench', nargs='?', default='all', choices=('all', 'topic-index', 'startup', 'throughput', 'sharding', 'config-load'))
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="throughput scenario (repeatable)")
+    parser.add_argument('--mappings', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', default='bench_results.json', help="JSON results file ('' to skip)")
+    parser.add_argument('--shards', type=int, action='append', help="shard count for the sharding bench (repeatable)")
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--run-shard', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_scenario:
+        # Child process of bench_throughput: print one JSON result line
+        params = json.loads(args.run_scenario)
+        print(json.dumps(run_scenario(params.pop('name'), **params)))
+        return
+    if args.run_shard:
+        # Child process of bench_sharding
+        print(json.dumps(run_shard(*json.loads(args.run_shard))))
+        return
+
+    if args.bench in ('all', 'topic-index'):
+        bench_topic_index()
+        print()
+    if args.bench in ('all', 'startup'):
+        bench_startup()
+        print()
+    if args.bench in ('all', 'throughput'):
+        bench_throughput(args.scenario, args.mappings, args.messages, args.workers, args.output)
+    if args.bench == 'config-load':
+        bench_config_load()
+    if args.bench == 'sharding':
+        bench_sharding(args.shards or (1, 2, 4), args.mappings, args.messages * 2, min(args.workers, 2))
+
+
+if __name__ == "__main__":
+    main()
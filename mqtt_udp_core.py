@@ -0,0 +1,2343 @@
+"""Routing core of the MQTT to UDP bridge, usable with or without the GUI"""
+import paho.mqtt.client as mqtt
+from datetime import datetime
+import ctypes
+import errno
+import json
+import socket
+import stat
+import struct
+import sys
+import threading
+import heapq
+import itertools
+import signal
+import time
+import os
+import re
+import select
+import tempfile
+import gc
+import hashlib
+import pickle
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+from mqtt_udp_ingress import IngressRoute, UDPIngress
+from mqtt_udp_metrics import DEFAULT_METRICS_SETTINGS, Metrics, MetricsServer
+from mqtt_udp_ratelimit import make_rate_limit
+from mqtt_udp_profile import DEFAULT_PROFILING_SETTINGS, ProfileCapture, SpanSampler
+from mqtt_udp_record import Recorder, replay
+from mqtt_udp_resolver import DEFAULT_RESOLVER_SETTINGS, parse_hosts_file, Resolver
+from mqtt_udp_retry import CircuitBreakers, DEFAULT_RETRY_SETTINGS, make_retry_policy, retriable, RetryQueue
+
+DEFAULT_MAPPINGS_FILE = "mqtt_udp_mappings.json"
+
+# Edits arriving within this many seconds of each other are written to disk once
+SAVE_DEBOUNCE_SECONDS = 0.5
+
+# How often poll_config() looks at the mappings file for external edits
+CONFIG_WATCH_INTERVAL = 1.0
+
+# Configs with at least this many mappings get a compiled snapshot next to
+# them (<mappings file>.cache); bump the version when the compiled classes change
+SNAPSHOT_MIN_MAPPINGS = 5000
+SNAPSHOT_VERSION = 2
+
+# BridgeCore attributes load_mappings fills from the config sections, kept in snapshots
+SNAPSHOT_SETTINGS = ('broker_settings', 'sender_settings', 'retry_settings', 'resolver_settings', 'profiling_settings',
+                     'metrics_settings', 'trigger_settings', 'destination_limit_settings', 'ingress_mappings')
+
+
+def write_atomic(path, write, binary=False):
+    """Call write(f) on a temp file next to path and rename it over path.
+
+    Readers (and a crash half way through) see either the old file or the
+    complete new one, never a truncated mix.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file 0600; keep the permissions of the file it replaces
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_json_atomic(path, data):
+    """Write data as JSON to path, see write_atomic"""
+    write_atomic(path, lambda f: json.dump(data, f, indent=2))
+
+
+def default_settings():
+    """Fresh settings for a config file that has none, keyed like SNAPSHOT_SETTINGS"""
+    return {
+        'broker_settings': {'address': 'localhost', 'port': 1883, 'auto_connect': True},
+        'sender_settings': dict(DEFAULT_SENDER_SETTINGS),
+        'retry_settings': dict(DEFAULT_RETRY_SETTINGS),
+        'resolver_settings': dict(DEFAULT_RESOLVER_SETTINGS),
+        'profiling_settings': dict(DEFAULT_PROFILING_SETTINGS),
+        'metrics_settings': dict(DEFAULT_METRICS_SETTINGS),
+        'trigger_settings': dict(DEFAULT_TRIGGER_SETTINGS),
+        'destination_limit_settings': {},
+        'ingress_mappings': [],
+    }
+
+
+@contextmanager
+def gc_paused():
+    """Hold off the cyclic garbage collector while building many objects at once.
+
+    Every few hundred allocations the collector would otherwise rescan all
+    the objects built so far, which dominates building a large index.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def file_stamp(path):
+    """(inode, size, mtime) of path, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def topic_matches(pattern, topic):
+    """Check if topic matches an MQTT topic filter (+ matches one level, # the rest)"""
+    if pattern == topic:
+        return True
+
+    pattern_parts = pattern.split('/')
+    topic_parts = topic.split('/')
+
+    # Wildcards at the first level never match $SYS-style topics
+    if topic.startswith('$') and pattern_parts[0] in ('+', '#'):
+        return False
+
+    last = len(pattern_parts) - 1
+    for i, p_part in enumerate(pattern_parts):
+        # '#' matches the parent level and any number of child levels
+        if p_part == '#' and i == last:
+            return True
+        if i >= len(topic_parts):
+            return False
+        if p_part != '+' and p_part != topic_parts[i]:
+            return False
+
+    return len(pattern_parts) == len(topic_parts)
+
+
+def valid_topic_filter(pattern):
+    """Check that pattern is a well-formed MQTT topic filter"""
+    if not pattern:
+        return False
+    levels = pattern.split('/')
+    for i, level in enumerate(levels):
+        if '#' in level and (level != '#' or i != len(levels) - 1):
+            return False
+        if '+' in level and level != '+':
+            return False
+    return True
+
+
+def filter_covers(wide, narrow):
+    """Check if every topic matched by filter narrow is also matched by filter wide"""
+    wide_parts = wide.split('/')
+    narrow_parts = narrow.split('/')
+
+    last = len(wide_parts) - 1
+    for i, w_part in enumerate(wide_parts):
+        # Wildcards at the first level never match $SYS-style topics
+        if i == 0 and w_part in ('+', '#') and narrow.startswith('$'):
+            return False
+        if w_part == '#' and i == last:
+            return True
+        if i >= len(narrow_parts) or narrow_parts[i] == '#':
+            return False
+        if w_part != '+' and w_part != narrow_parts[i]:
+            return False
+
+    return len(wide_parts) == len(narrow_parts)
+
+
+class TopicIndex:
+    """Trie of MQTT topic filters keyed by topic level.
+
+    Lookups walk the topic one level at a time, so the cost depends on the
+    topic depth (and the number of wildcard branches on the way), not on how
+    many filters are indexed. Values are returned in insertion order.
+    """
+
+    class _Node:
+        __slots__ = ('children', 'plus', 'hash', 'entries')
+
+        def __init__(self):
+            self.children = {}   # literal level -> node
+            self.plus = None     # node for a '+' level
+            self.hash = ()       # (seq, value) for filters ending in '#' here
+            self.entries = ()    # (seq, value) for filters ending exactly here
+
+    def __init__(self, items=()):
+        self._root = self._Node()
+        self._seq = 0
+        self._count = 0
+        for pattern, value in items:
+            self.add(pattern, value)
+
+    def __len__(self):
+        return self._count
+
+    def add(self, pattern, value):
+        """Index value under the topic filter pattern"""
+        node = self._root
+        levels = pattern.split('/')
+        last = len(levels) - 1
+        entry = (self._seq, value)
+        self._seq += 1
+        self._count += 1
+
+        for i, level in enumerate(levels):
+            if level == '#' and i == last:
+                # Tuples are replaced, never mutated, so concurrent lookups stay safe
+                node.hash = node.hash + (entry,)
+                return
+            if level == '+':
+                if node.plus is None:
+                    node.plus = self._Node()
+                node = node.plus
+            else:
+                child = node.children.get(level)
+                if child is None:
+                    child = self._Node()
+                    node.children[level] = child
+                node = child
+
+        node.entries = node.entries + (entry,)
+
+    def remove(self, pattern, value):
+        """Remove value from the topic filter pattern, returns True if it was indexed"""
+        node = self._root
+        levels = pattern.split('/')
+        last = len(levels) - 1
+        path = []
+
+        for i, level in enumerate(levels):
+            if level == '#' and i == last:
+                kept = tuple(e for e in node.hash if e[1] is not value)
+                if len(kept) == len(node.hash):
+                    return False
+                node.hash = kept
+                break
+            path.append((node, level))
+            node = node.plus if level == '+' else node.children.get(level)
+            if node is None:
+                return False
+        else:
+            kept = tuple(e for e in node.entries if e[1] is not value)
+            if len(kept) == len(node.entries):
+                return False
+            node.entries = kept
+
+        self._count -= 1
+
+        # Prune branches that no longer lead to any filter
+        for parent, level in reversed(path):
+            if node.entries or node.hash or node.children or node.plus is not None:
+                break
+            if level == '+':
+                parent.plus = None
+            else:
+                del parent.children[level]
+            node = parent
+        return True
+
+    def match(self, topic):
+        """Return the values of every filter matching topic"""
+        levels = topic.split('/')
+        # Wildcards at the first level never match $SYS-style topics
+        wildcards = not topic.startswith('$')
+        found = []
+        nodes = [self._root]
+
+        for level in levels:
+            next_nodes = []
+            for node in nodes:
+                if node.hash and wildcards:
+                    found.extend(node.hash)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.plus is not None and wildcards:
+                    next_nodes.append(node.plus)
+            nodes = next_nodes
+            if not nodes:
+                break
+            wildcards = True
+        else:
+            for node in nodes:
+                found.extend(node.entries)
+                # 'a/#' also matches the parent level 'a'
+                found.extend(node.hash)
+
+        if len(found) > 1:
+            found.sort(key=lambda entry: entry[0])
+        return [value for _, value in found]
+
+    def covering(self, pattern):
+        """Return the values of every filter that matches all the topics the
+        filter pattern matches (see filter_covers), pattern itself included.
+
+        Like match(), but a '+' level in pattern only follows '+' branches
+        and a trailing '#' is only covered by a '#'.
+        """
+        levels = pattern.split('/')
+        last = len(levels) - 1
+        # Wildcards at the first level never cover $SYS-style filters
+        wildcards = not pattern.startswith('$')
+        found = []
+        nodes = [self._root]
+
+        for i, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                if node.hash and wildcards:
+                    found.extend(node.hash)
+                if level == '#' and i == last:
+                    continue
+                if level != '+':
+                    child = node.children.get(level)
+                    if child is not None:
+                        next_nodes.append(child)
+                if node.plus is not None and wildcards:
+                    next_nodes.append(node.plus)
+            nodes = next_nodes
+            if not nodes:
+                break
+            wildcards = True
+        else:
+            for node in nodes:
+                found.extend(node.entries)
+                # 'a/#' also covers the parent level 'a'
+                found.extend(node.hash)
+
+        if len(found) > 1:
+            found.sort(key=lambda entry: entry[0])
+        return [value for _, value in found]
+
+
+# Field names probed (in order) when a JSON object payload has no "Val" field
+VALUE_KEYS = ('value', 'val', 'state', 'status', 'data')
+
+_UNSET = object()
+
+
+# Bytes of a non-UTF-8 payload shown in log lines
+BINARY_PREVIEW_BYTES = 32
+
+
+class PayloadView:
+    """Decoded forms of one MQTT payload, shared by every mapping that matches it.
+
+    Built from the payload bytes as received, or from text. Each form is
+    computed on first use and cached, so a payload is decoded, stripped,
+    JSON-parsed and converted to a number at most once per message, and
+    not at all when nothing asks for it. Payloads that are not valid UTF-8
+    are decoded with replacement characters for triggers and logging,
+    while {payload} still sends the original bytes.
+    """
+
+    __slots__ = ('received', 'binary', 'sampled', 'dispatched', '_raw', '_data', '_stripped', '_json_values', '_number')
+
+    def __init__(self, raw=None, data=None, received=None):
+        self.received = received  # perf_counter() when the MQTT callback started
+        self.binary = False  # set when decoding finds invalid UTF-8
+        self.sampled = False  # stages of this message are timed
+        self.dispatched = None  # perf_counter() when a sampled message went to the sender pool
+        self._raw = raw
+        self._data = data
+        self._stripped = None
+        self._json_values = _UNSET
+        self._number = _UNSET
+
+    @property
+    def raw(self):
+        """Payload as text"""
+        if self._raw is None:
+            try:
+                self._raw = self._data.decode('utf-8')
+            except UnicodeDecodeError:
+                self.binary = True
+                self._raw = self._data.decode('utf-8', 'replace')
+        return self._raw
+
+    @property
+    def data(self):
+        """Payload as bytes, exactly as received"""
+        if self._data is None:
+            self._data = self._raw.encode('utf-8')
+        return self._data
+
+    @property
+    def display(self):
+        """Payload for log lines: the text, or a hex preview of a non-UTF-8 payload"""
+        text = self.raw
+        if not self.binary:
+            return text
+        data = self._data
+        more = '…' if len(data) > BINARY_PREVIEW_BYTES else ''
+        return f"<{len(data)} bytes: {data[:BINARY_PREVIEW_BYTES].hex(' ')}{more}>"
+
+    @property
+    def last_value(self):
+        """What the edge and change modes remember: the stripped text, or the bytes of a non-UTF-8 payload"""
+        stripped = self.stripped
+        return self._data if self.binary else stripped
+
+    @property
+    def stripped(self):
+        if self._stripped is None:
+            self._stripped = self.raw.strip()
+        return self._stripped
+
+    @property
+    def json_values(self):
+        """Trigger candidates from the JSON payload as (exact, text), or None.
+
+        exact is True when text is the single value to compare against (a
+        scalar payload, "Val" or one of VALUE_KEYS); otherwise text is the
+        set of all the object's values stringified.
+        """
+        if self._json_values is _UNSET:
+            self._json_values = None
+            try:
+                data = json.loads(self.raw)
+            except (json.JSONDecodeError, TypeError):
+                return None
+
+            if isinstance(data, (str, int, float)):
+                self._json_values = (True, str(data))
+            elif isinstance(data, dict):
+                if "Val" in data:
+                    self._json_values = (True, str(data["Val"]))
+                else:
+                    for key in VALUE_KEYS:
+                        if key in data:
+                            self._json_values = (True, str(data[key]))
+                            break
+                    else:
+                        self._json_values = (False, frozenset(str(value) for value in data.values()))
+        return self._json_values
+
+    @property
+    def number(self):
+        """Payload as a float, or None if it is not numeric"""
+        if self._number is _UNSET:
+            try:
+                self._number = float(self.stripped)
+            except ValueError:
+                self._number = None
+        return self._number
+
+
+class TriggerPredicate:
+    """Compiled form of a mapping's trigger_value.
+
+    Matching rules, in order: empty trigger matches anything; exact match
+    of the stripped payload; for JSON payloads the scalar value, "Val",
+    the first of VALUE_KEYS present, or else any value of the object;
+    finally a numeric comparison.
+    """
+
+    __slots__ = ('value', 'number', 'always')
+
+    def __init__(self, trigger_value):
+        self.value = trigger_value
+        self.always = trigger_value == ''
+        try:
+            self.number = float(trigger_value)
+        except ValueError:
+            self.number = None
+
+    def matches(self, view):
+        """Check if the payload view should trigger UDP sending"""
+        if self.always:
+            return True
+
+        value = self.value
+        if view.stripped == value:
+            return True
+
+        json_values = view.json_values
+        if json_values is not None:
+            exact, text = json_values
+            if exact:
+                return text == value
+            if value in text:
+                return True
+
+        if self.number is None:
+            return False
+        number = view.number
+        return number is not None and number == self.number
+
+
+@lru_cache(maxsize=4096)
+def compile_trigger(trigger_value):
+    """Return the (shared, immutable) predicate for a trigger_value"""
+    return TriggerPredicate(trigger_value)
+
+
+# level: every matching payload; rising/falling: only when the trigger starts/stops
+# matching on a topic; change: matching payloads that differ from the last one
+TRIGGER_MODES = ('level', 'rising', 'falling', 'change')
+
+DEFAULT_TRIGGER_SETTINGS = {'cache_size': 10000}
+
+
+class LastValueCache:
+    """Last payload seen on each topic, for the edge and change trigger modes.
+
+    Holds one stripped payload string per topic (the bytes of a non-UTF-8
+    payload). Wildcard mappings can see an unbounded number of topics, so
+    the cache keeps at most max_topics and evicts the least recently
+    updated; an evicted topic counts as unseen, so its next payload is
+    treated as a change.
+    """
+
+    def __init__(self, max_topics=10000):
+        self.max_topics = max_topics
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def swap(self, topic, value):
+        """Store value for topic and return the previous one (None if unseen)"""
+        values = self._values
+        with self._lock:
+            previous = values.get(topic)
+            values[topic] = value
+            if previous is not None:
+                values.move_to_end(topic)
+            elif len(values) > self.max_topics:
+                values.popitem(last=False)
+                self.evictions += 1
+        return previous
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def __len__(self):
+        return len(self._values)
+
+    def stats(self):
+        return {'topics': len(self._values), 'max_topics': self.max_topics, 'evictions': self.evictions}
+
+
+_PLACEHOLDER_RE = re.compile(r'\{(payload|topic)\}')
+
+
+class MessageTemplate:
+    """A udp_message compiled into literal byte segments and placeholders.
+
+    Templates without placeholders are encoded once and sent as the same
+    bytes object every time, and a bare '{payload}' sends the payload bytes
+    as received, without a copy. Otherwise rendering fills the {payload}
+    and {topic} slots and joins the segments once; the template text is
+    never rescanned.
+    """
+
+    __slots__ = ('text', 'constant', 'passthrough', 'parts', 'slots', 'uses_topic')
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        self.slots = []  # (index in parts, placeholder name)
+        position = 0
+        for match in _PLACEHOLDER_RE.finditer(text):
+            if match.start() > position:
+                self.parts.append(text[position:match.start()].encode('utf-8'))
+            self.slots.append((len(self.parts), match.group(1)))
+            self.parts.append(b'')
+            position = match.end()
+        if position < len(text):
+            self.parts.append(text[position:].encode('utf-8'))
+
+        self.constant = text.encode('utf-8') if not self.slots else None
+        self.uses_topic = any(name == 'topic' for _, name in self.slots)
+        self.passthrough = text == '{payload}'
+
+    def render(self, topic, view):
+        """Bytes to send for a message on topic with the given PayloadView"""
+        if self.constant is not None:
+            return self.constant
+        if self.passthrough:
+            return view.data
+        parts = self.parts.copy()
+        topic_data = topic.encode('utf-8') if self.uses_topic else None
+        for index, name in self.slots:
+            parts[index] = view.data if name == 'payload' else topic_data
+        return b''.join(parts)
+
+
+@lru_cache(maxsize=4096)
+def compile_template(udp_message):
+    """Return the (shared, immutable) compiled form of a udp_message"""
+    return MessageTemplate(udp_message)
+
+
+def mapping_destinations(mapping):
+    """(host, port) tuples a mapping sends to"""
+    destinations = mapping.get('destinations')
+    if not destinations:
+        return [(mapping['udp_ip'], int(mapping['udp_port']))]
+    return [(d['udp_ip'], int(d['udp_port'])) for d in destinations]
+
+
+def set_destinations(mapping, destinations):
+    """Store (host, port) destinations on a mapping, mirroring the first in udp_ip/udp_port"""
+    mapping['udp_ip'], mapping['udp_port'] = destinations[0]
+    if len(destinations) > 1:
+        mapping['destinations'] = [{'udp_ip': host, 'udp_port': port} for host, port in destinations]
+    else:
+        # Single-destination mappings keep the original file format
+        mapping.pop('destinations', None)
+
+
+def format_destinations(destinations):
+    """'host:port, [v6addr]:port' text for (host, port) tuples"""
+    return ", ".join(f"[{host}]:{port}" if ':' in host else f"{host}:{port}" for host, port in destinations)
+
+
+def parse_destinations(text):
+    """Parse 'host:port, [v6addr]:port' into (host, port) tuples, raises ValueError"""
+    destinations = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith('['):
+            host, sep, port = item[1:].partition(']:')
+        else:
+            host, sep, port = item.rpartition(':')
+            if ':' in host:
+                raise ValueError(f"Write IPv6 destinations as [address]:port, got '{item}'")
+        if not sep or not host:
+            raise ValueError(f"Destination '{item}' must be host:port")
+        try:
+            port = int(port)
+        except ValueError:
+            raise ValueError(f"UDP Port must be a number in '{item}'")
+        if not 0 < port < 65536:
+            raise ValueError(f"UDP Port out of range in '{item}'")
+        destinations.append((host, port))
+    if not destinations:
+        raise ValueError("At least one destination (host:port) is required")
+    return destinations
+
+
+class MappingRoute:
+    """A mapping together with the state compiled from it for on_message"""
+
+    __slots__ = ('mapping', 'trigger', 'mode', 'template', 'destinations', 'destinations_text', 'rate_limit', 'retry')
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.trigger = compile_trigger(mapping.get('trigger_value', ''))
+        self.mode = mapping.get('trigger_mode', 'level')
+        if self.mode not in TRIGGER_MODES:
+            self.mode = 'level'
+        self.template = compile_template(mapping['udp_message'])
+        self.destinations = tuple(mapping_destinations(mapping))
+        self.destinations_text = format_destinations(self.destinations)
+        self.rate_limit = make_rate_limit(mapping)
+        self.retry = make_retry_policy(mapping)
+
+    def fires(self, view, previous):
+        """Whether view triggers a send, given the previous payload on its topic (None if unseen)"""
+        mode = self.mode
+        if mode == 'level':
+            return self.trigger.matches(view)
+        if previous == view.last_value:
+            # The device republished the value it already had
+            return False
+        matched = self.trigger.matches(view)
+        if mode == 'change':
+            return matched
+        if previous is None:
+            was_matched = False
+        elif isinstance(previous, str):
+            was_matched = self.trigger.matches(PayloadView(previous))
+        else:
+            was_matched = self.trigger.matches(PayloadView(data=previous))
+        if mode == 'rising':
+            return matched and not was_matched
+        return was_matched and not matched
+
+
+# Values of the 'protocol' broker setting
+MQTT_PROTOCOLS = {'3.1': mqtt.MQTTv31, '3.1.1': mqtt.MQTTv311, '5': mqtt.MQTTv5}
+
+# MQTT 5 retain handling: 0 send retained messages on subscribe,
+# 1 only for a new subscription, 2 never
+RETAIN_HANDLING = (0, 1, 2)
+
+
+class SubscriptionManager:
+    """Keeps the broker's subscriptions in step with the mapping topics.
+
+    Each sync diffs the wanted topic filters against the ones already
+    subscribed and sends one batched SUBSCRIBE and one batched UNSUBSCRIBE
+    for the difference. Filters covered by a wider wildcard filter in the
+    same set (with at least the same QoS) are left out, which also stops
+    the broker from delivering overlapping matches twice.
+
+    With a share group every filter is subscribed as $share/<group>/<filter>,
+    so the broker splits the messages between all clients of the group.
+    Under MQTT 5 each filter also carries the no-local, retain-as-published
+    and retain-handling options.
+    """
+
+    def __init__(self):
+        self.active = {}  # broker filter -> qos, or (qos, options) under MQTT 5
+        self.share_group = ''
+        self.v5_options = None  # (no_local, retain_as_published, retain_handling), None below MQTT 5
+        self._lock = threading.Lock()
+
+    def configure(self, share_group='', v5_options=None):
+        """Set the share group and MQTT 5 options, applied by the next sync. Raises ValueError"""
+        share_group = share_group or ''
+        if share_group and any(c in share_group for c in '/+#'):
+            raise ValueError(f"share group '{share_group}' must not contain '/', '+' or '#'")
+        if v5_options is not None:
+            no_local, _, retain_handling = v5_options
+            if retain_handling not in RETAIN_HANDLING:
+                raise ValueError(f"retain_handling must be 0, 1 or 2, got {retain_handling}")
+            if no_local and share_group:
+                raise ValueError("no_local cannot be used with a share group")
+        with self._lock:
+            self.share_group = share_group
+            self.v5_options = v5_options
+
+    def broker_filter(self, topic):
+        """The filter as subscribed, with the share group prefix if any"""
+        return f"$share/{self.share_group}/{topic}" if self.share_group else topic
+
+    @staticmethod
+    def reduce(topics):
+        """Drop filters from a {filter: qos} dict that a wider filter already covers"""
+        wildcards = [t for t in topics if '+' in t or '#' in t]
+        if not wildcards:
+            return dict(topics)
+
+        # Each filter only walks the trie branches of the wildcards covering it,
+        # rather than testing every pair of wildcards
+        index = TopicIndex((t, t) for t in wildcards)
+        wanted = {}
+        for topic, qos in topics.items():
+            for wide in index.covering(topic):
+                if wide != topic and topics[wide] >= qos:
+                    break
+            else:
+                wanted[topic] = qos
+        return wanted
+
+    def sync(self, client, topics):
+        """Bring the client's subscriptions in line with {filter: qos}, returns (added, removed)"""
+        with self._lock:
+            options = self.v5_options
+            wanted = {}
+            for topic, qos in self.reduce(topics).items():
+                wanted[self.broker_filter(topic)] = qos if options is None else (qos, options)
+            added = [(t, spec) for t, spec in wanted.items() if self.active.get(t) != spec]
+            removed = [t for t in self.active if t not in wanted]
+            # Subscribe before unsubscribing, so swapping a filter for a narrower
+            # one (or changing the share group) leaves no gap without a subscription
+            if added:
+                if options is None:
+                    client.subscribe(added)
+                else:
+                    no_local, retain_as_published, retain_handling = options
+                    client.subscribe([(t, mqtt.SubscribeOptions(qos=qos, noLocal=no_local,
+                                                                retainAsPublished=retain_as_published,
+                                                                retainHandling=retain_handling))
+                                      for t, (qos, _) in added])
+            if removed:
+                client.unsubscribe(removed)
+            self.active = wanted
+            return added, removed
+
+    def reset(self):
+        """Forget the active subscriptions (the broker dropped them)"""
+        with self._lock:
+            self.active = {}
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    """libc sendmmsg(2) via ctypes, or None where it is not available"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        sendmmsg = ctypes.CDLL(None, use_errno=True).sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int)
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _load_sendmmsg()
+
+# Below this many datagrams per address family the ctypes call costs more than a sendto() loop
+SENDMMSG_MIN_DESTINATIONS = 4
+
+
+def _pack_sockaddr(family, sockaddr):
+    """Raw Linux struct sockaddr_in / sockaddr_in6 bytes for a socket address tuple"""
+    if family == socket.AF_INET:
+        host, port = sockaddr[:2]
+        return struct.pack('=H', family) + struct.pack('!H', port) + socket.inet_pton(family, host) + bytes(8)
+    host, port, flowinfo, scope_id = sockaddr
+    return (struct.pack('=H', family) + struct.pack('!HI', port, flowinfo)
+            + socket.inet_pton(family, host.split('%')[0]) + struct.pack('=I', scope_id))
+
+
+class UDPSender:
+    """Pool of long-lived UDP sockets, one connected socket per destination.
+
+    Sockets are created on the first send to a (host, port) and reused for
+    every later send; the destination may be IPv4 or IPv6. Addresses come
+    from the resolver's cache, and a socket is reconnected when the
+    resolver reports a new address for its hostname.
+    """
+
+    def __init__(self, timeout=5, resolver=None):
+        self.timeout = timeout
+        self.resolver = resolver or Resolver()
+        self.resolver.on_change = self.forget
+        self._sockets = {}  # (host, port) -> connected socket
+        self._unconnected = {}  # family -> socket shared by fan-out sends
+        self._addresses = {}  # (host, port) -> (family, sockaddr, packed sockaddr)
+        self._local = threading.local()  # per-thread sendmmsg header arrays
+        self._lock = threading.Lock()
+        self.sockets_created = 0
+        self.sends = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _get_socket(self, key):
+        sock = self._sockets.get(key)
+        if sock is None:
+            # Resolve and connect outside the lock, so a slow first lookup of
+            # one hostname does not hold up sends to every other destination
+            family, sockaddr = self.resolver.resolve(*key)
+            new = socket.socket(family, socket.SOCK_DGRAM)
+            try:
+                new.settimeout(self.timeout)
+                new.connect(sockaddr)
+            except OSError:
+                new.close()
+                raise
+            with self._lock:
+                sock = self._sockets.get(key)
+                if sock is None:
+                    sock = self._sockets[key] = new
+                    self.sockets_created += 1
+            if sock is not new:
+                new.close()  # Another thread connected one first
+        return sock
+
+    def _discard(self, key, sock):
+        with self._lock:
+            if self._sockets.get(key) is sock:
+                del self._sockets[key]
+        sock.close()
+
+    def forget(self, key):
+        """Drop the socket and address cached for a destination whose address changed"""
+        with self._lock:
+            sock = self._sockets.pop(key, None)
+            self._addresses.pop(key, None)
+        if sock is not None:
+            sock.close()
+
+    def send(self, host, port, data):
+        """Send one datagram to host:port"""
+        key = (host, port)
+        sock = None
+        try:
+            sock = self._get_socket(key)
+            sock.send(data)
+        except ConnectionRefusedError:
+            # ICMP port unreachable from an earlier datagram, the socket itself is fine
+            self.errors += 1
+            raise
+        except OSError:
+            self.errors += 1
+            if sock is not None:
+                self._discard(key, sock)
+            raise
+        self.sends += 1
+
+    def _resolve(self, key):
+        address = self._addresses.get(key)
+        if address is None:
+            family, sockaddr = self.resolver.resolve(*key)
+            address = (family, sockaddr, _pack_sockaddr(family, sockaddr) if _sendmmsg else None)
+            self._addresses[key] = address
+        return address
+
+    def _get_unconnected(self, family):
+        sock = self._unconnected.get(family)
+        if sock is None:
+            with self._lock:
+                sock = self._unconnected.get(family)
+                if sock is None:
+                    sock = socket.socket(family, socket.SOCK_DGRAM)
+                    sock.settimeout(self.timeout)
+                    self._unconnected[family] = sock
+                    self.sockets_created += 1
+        return sock
+
+    def send_many(self, destinations, data):
+        """Send the same datagram to every (host, port), returns [(destination, error)] for failures.
+
+        On Linux the datagrams for each address family go out in one
+        sendmmsg(2) call once there are SENDMMSG_MIN_DESTINATIONS of them;
+        otherwise they are sent in a loop.
+        """
+        if len(destinations) == 1:
+            try:
+                self.send(destinations[0][0], destinations[0][1], data)
+                return []
+            except OSError as e:
+                return [(destinations[0], e)]
+
+        failures = []
+        by_family = {}
+        for destination in destinations:
+            try:
+                family, sockaddr, packed = self._resolve(destination)
+            except OSError as e:
+                self.errors += 1
+                failures.append((destination, e))
+                continue
+            by_family.setdefault(family, []).append((destination, sockaddr, packed))
+
+        for family, targets in by_family.items():
+            sock = self._get_unconnected(family)
+            if _sendmmsg is not None and len(targets) >= SENDMMSG_MIN_DESTINATIONS:
+                failures.extend(self._sendmmsg(sock, targets, data))
+                continue
+            for destination, sockaddr, _ in targets:
+                try:
+                    sock.sendto(data, sockaddr)
+                    self.sends += 1
+                except OSError as e:
+                    self.errors += 1
+                    failures.append((destination, e))
+        return failures
+
+    def _prepare_batch(self, targets):
+        """mmsghdr array for targets, built once per thread and destination set"""
+        batches = getattr(self._local, 'batches', None)
+        if batches is None:
+            batches = self._local.batches = {}
+        key = tuple(packed for _, _, packed in targets)
+        batch = batches.get(key)
+        if batch is None:
+            # All headers share one iovec that points at the datagram being sent
+            iov = _IOVec()
+            names = [ctypes.create_string_buffer(packed, len(packed)) for packed in key]
+            messages = (_MMsgHdr * len(key))()
+            for message, name in zip(messages, names):
+                message.msg_hdr.msg_name = ctypes.cast(name, ctypes.c_void_p)
+                message.msg_hdr.msg_namelen = len(name)
+                message.msg_hdr.msg_iov = ctypes.pointer(iov)
+                message.msg_hdr.msg_iovlen = 1
+            batch = batches[key] = (messages, iov, names)
+        return batch
+
+    def _sendmmsg(self, sock, targets, data):
+        messages, iov, _ = self._prepare_batch(targets)
+        buffer = ctypes.c_char_p(data)  # Points into data, no copy
+        iov.iov_base = ctypes.cast(buffer, ctypes.c_void_p)
+        iov.iov_len = len(data)
+
+        failures = []
+        count = len(targets)
+        sent = 0
+        deadline = None
+        while sent < count:
+            result = _sendmmsg(sock.fileno(), ctypes.addressof(messages) + sent * ctypes.sizeof(_MMsgHdr), count - sent, 0)
+            self.batches += 1
+            if result < 0:
+                code = ctypes.get_errno()
+                if code == errno.EINTR:
+                    continue
+                if code in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # The socket is non-blocking (it has a timeout), so a full send
+                    # buffer fails at once; wait for room like sendto() does, with
+                    # the socket timeout bounding the whole batch
+                    if deadline is None:
+                        deadline = time.monotonic() + self.timeout
+                    if self._wait_writable(sock, deadline):
+                        continue
+                    error = TimeoutError('timed out')
+                else:
+                    error = OSError(code, os.strerror(code))
+                # The datagram at 'sent' failed, report it and carry on with the rest
+                self.errors += 1
+                failures.append((targets[sent][0], error))
+                sent += 1
+            else:
+                self.sends += result
+                sent += result
+        return failures
+
+    @staticmethod
+    def _wait_writable(sock, deadline):
+        """Wait until sock has room in its send buffer, False if deadline passed first"""
+        poller = select.poll()
+        poller.register(sock, select.POLLOUT)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if poller.poll(remaining * 1000):
+                return True
+
+    def close(self):
+        """Close every pooled socket"""
+        with self._lock:
+            sockets = list(self._sockets.values()) + list(self._unconnected.values())
+            self._sockets.clear()
+            self._unconnected.clear()
+        for sock in sockets:
+            sock.close()
+
+    def stats(self):
+        return {
+            'sockets_open': len(self._sockets) + len(self._unconnected),
+            'sockets_created': self.sockets_created,
+            'sends': self.sends,
+            'batches': self.batches,
+            'errors': self.errors,
+        }
+
+
+# What SendDispatcher.submit does when the queue is full
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+DEFAULT_SENDER_SETTINGS = {'workers': 4, 'queue_size': 10000, 'overflow': 'drop_oldest'}
+
+
+class SendDispatcher:
+    """Fixed pool of sender threads fed by a bounded queue.
+
+    submit() only appends to the queue, so the caller (the MQTT network
+    thread) never pays for thread creation. When the queue is full the
+    overflow policy decides: 'block' waits for room, 'drop_oldest' discards
+    the oldest queued send, 'drop_newest' discards the one being submitted.
+    """
+
+    def __init__(self, workers=4, queue_size=10000, overflow='drop_oldest', name='udp-sender'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}'")
+        self.queue_size = max(1, int(queue_size))
+        self.overflow = overflow
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._running = True
+        self.submitted = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+        self._threads = []
+        for i in range(max(1, int(workers))):
+            thread = threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args):
+        """Queue func(*args), returns False if it was dropped"""
+        with self._lock:
+            if not self._running:
+                return False
+            if len(self._queue) >= self.queue_size:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                if self.overflow == 'drop_oldest':
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._queue) >= self.queue_size and self._running:
+                        self._not_full.wait()
+                    if not self._running:
+                        return False
+            self._queue.append((func, args))
+            self.submitted += 1
+            if len(self._queue) > self.max_depth:
+                self.max_depth = len(self._queue)
+            self._not_empty.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue and self._running:
+                    self._not_empty.wait()
+                if not self._queue:
+                    return  # Stopped and drained
+                func, args = self._queue.popleft()
+                self._not_full.notify()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Error in sender thread: {str(e)}")
+
+    def stop(self, timeout=1.0):
+        """Stop accepting work and let the workers drain the queue"""
+        with self._lock:
+            self._running = False
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        return {
+            'workers': len(self._threads),
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'queue_size': self.queue_size,
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+        }
+
+
+class _ScheduledCall:
+    __slots__ = ('due', 'key', 'func', 'args', 'cancelled')
+
+    def __init__(self, due, key, func, args):
+        self.due = due
+        self.key = key
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+
+class DelayScheduler:
+    """Single thread that runs callbacks after a delay, backed by a heap.
+
+    Replaces one threading.Timer (and OS thread) per delayed send. Calls are
+    grouped by key so all pending calls for a mapping can be cancelled at
+    once. Callbacks run on the scheduler thread and must be quick, e.g. a
+    hand-off to the SendDispatcher.
+    """
+
+    def __init__(self, name='udp-delay'):
+        self._heap = []      # (due, seq, call)
+        self._by_key = {}    # key -> set of pending calls
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = True
+        self.pending = 0
+        self.fired = 0
+        self.cancelled = 0
+        self.max_lateness = 0.0
+        self._total_lateness = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, delay, key, func, *args):
+        """Run func(*args) after delay seconds"""
+        call = _ScheduledCall(time.monotonic() + delay, key, func, args)
+        with self._cond:
+            heapq.heappush(self._heap, (call.due, next(self._seq), call))
+            self._by_key.setdefault(key, set()).add(call)
+            self.pending += 1
+            # Only wake the thread if this call is now the next one due
+            if self._heap[0][2] is call:
+                self._cond.notify()
+        return call
+
+    def cancel(self, key):
+        """Cancel every pending call scheduled under key, returns how many"""
+        with self._cond:
+            return self._cancel_calls(self._by_key.pop(key, ()))
+
+    def cancel_all(self):
+        """Cancel every pending call, returns how many"""
+        with self._cond:
+            count = 0
+            for calls in self._by_key.values():
+                count += self._cancel_calls(calls)
+            self._by_key.clear()
+            return count
+
+    def _cancel_calls(self, calls):
+        for call in calls:
+            call.cancelled = True
+        self.pending -= len(calls)
+        self.cancelled += len(calls)
+
+        # Cancelled calls stay in the heap until they come due; compact it
+        # when they start to dominate
+        if len(self._heap) > 2 * self.pending + 64:
+            self._heap = [item for item in self._heap if not item[2].cancelled]
+            heapq.heapify(self._heap)
+        return len(calls)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    call = self._heap[0][2]
+                    if call.cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    wait = call.due - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if not self._running:
+                    return
+
+                heapq.heappop(self._heap)
+                calls = self._by_key.get(call.key)
+                if calls is not None:
+                    calls.discard(call)
+                    if not calls:
+                        del self._by_key[call.key]
+                self.pending -= 1
+                self.fired += 1
+                lateness = time.monotonic() - call.due
+                self._total_lateness += lateness
+                if lateness > self.max_lateness:
+                    self.max_lateness = lateness
+
+            try:
+                call.func(*call.args)
+            except Exception as e:
+                print(f"Error in delayed call: {str(e)}")
+
+    def stop(self):
+        """Stop the scheduler thread, dropping pending calls"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(1.0)
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'fired': self.fired,
+            'cancelled': self.cancelled,
+            'avg_lateness': self._total_lateness / self.fired if self.fired else 0.0,
+            'max_lateness': self.max_lateness,
+        }
+
+
+class LogPipeline:
+    """Log records queued from any thread and drained in batches by one consumer.
+
+    push() is a single deque append, so it never blocks the MQTT receive
+    path. The queue is bounded; when producers outrun the consumer the
+    oldest records are discarded.
+    """
+
+    def __init__(self, max_pending=10000):
+        self._records = deque(maxlen=max_pending)
+
+    def push(self, message):
+        self._records.append(message)
+
+    def drain(self):
+        """Return every record queued so far, oldest first"""
+        records = self._records
+        overflowed = len(records) == records.maxlen
+        batch = [records.popleft() for _ in range(len(records))]
+        if overflowed:
+            batch.insert(0, "⚠️ Log backlog full, older lines skipped")
+        return batch
+
+
+class BridgeCore:
+    """MQTT to UDP routing without any GUI: config, matching, triggering and sending.
+
+    The Tk application (mqtt_udp_gui.MQTTUDPBridge) subclasses this and
+    overrides the display hooks; run_headless() drives it directly.
+    """
+
+    def __init__(self, mappings_file=DEFAULT_MAPPINGS_FILE):
+        self.client = None
+        self.connected = False
+        self.udp_sending_enabled = True
+        self.udp_mappings = []
+        self.topic_index = TopicIndex()
+        self.subscriptions = SubscriptionManager()
+        self.udp_sender = UDPSender()
+        self.log_pipeline = LogPipeline()
+        self.metrics = Metrics()
+        self.metrics_server = None
+        self.broker_settings = {'address': 'localhost', 'port': 1883, 'auto_connect': True}
+        self.protocol = mqtt.MQTTv311
+        self.ignore_retained = False
+        self.recorder = None
+        self.mappings_file = mappings_file
+        self.save_due = None  # monotonic time of a pending debounced save
+        self.next_config_check = 0.0
+        
+        self.spans = SpanSampler()
+        self.profile_capture = None
+        
+        # Load existing mappings and settings
+        self.load_mappings()
+        self.configure_resolver()
+        self.configure_profiling()
+        
+        # Sender threads, fed from on_message through a bounded queue
+        self.dispatcher = SendDispatcher(**self.sender_settings)
+        
+        # Single timer thread for mappings with a UDP delay
+        self.scheduler = DelayScheduler()
+        
+        # Failed sends waiting for a retry, and the destinations that keep failing
+        self.retry_queue = RetryQueue(self.retry_settings['queue_size'], self.retry_settings['overflow'])
+        self.breakers = CircuitBreakers(self.retry_settings['breaker_failures'], self.retry_settings['breaker_reset'])
+        
+        # Latest refused send per rate-limited mapping or destination, see rate_gate
+        self._coalesced = {}
+        self._coalesce_lock = threading.Lock()
+        
+        # Last payload per topic for the edge and change trigger modes
+        self.last_values = LastValueCache(int(self.trigger_settings['cache_size']))
+        
+        # UDP listeners publishing to MQTT (the reverse direction)
+        self.ingress = UDPIngress(self.publish_ingress, self.count_unmatched_ingress, self.log_message)
+        self.configure_ingress()
+    
+    def set_status(self, text, color=None):
+        """Report connection status (shown in the status bar by the GUI)"""
+        pass
+    
+    def update_mqtt_subscriptions(self):
+        if self.client and self.connected:
+            topics = {}
+            for mapping in self.udp_mappings:
+                topic = mapping['topic']
+                if not valid_topic_filter(topic):
+                    self.log_message(f"⚠️ Not subscribing to invalid topic filter '{topic}'")
+                    continue
+                qos = mapping.get('qos', 0)
+                if qos not in (0, 1, 2):
+                    self.log_message(f"⚠️ Invalid qos {qos!r} for '{topic}', using 0")
+                    qos = 0
+                # Mappings sharing a filter get the highest QoS any of them asks for
+                topics[topic] = max(qos, topics.get(topic, 0))
+            
+            # Only the difference to the active subscriptions goes to the broker
+            try:
+                self.subscriptions.configure(self.broker_settings.get('share_group', ''), self.subscription_options())
+                added, removed = self.subscriptions.sync(self.client, topics)
+            except ValueError as e:
+                self.log_message(f"❌ Subscription error: {str(e)}")
+                return
+            if added or removed:
+                self.log_message(f"📡 Subscribed to {len(added)} topics, unsubscribed from {len(removed)}")
+    
+    def subscription_options(self):
+        """(no_local, retain_as_published, retain_handling) under MQTT 5, else None"""
+        if self.protocol != mqtt.MQTTv5:
+            return None
+        return (bool(self.broker_settings.get('no_local', False)),
+                bool(self.broker_settings.get('retain_as_published', False)),
+                self.broker_settings.get('retain_handling', 0))
+    
+    def client_id(self):
+        """MQTT client ID from the broker settings, '' to let the broker pick one"""
+        return self.broker_settings.get('client_id', '')
+    
+    def connect_mqtt(self):
+        """Connect to the broker in broker_settings, returns True on success"""
+        broker = self.broker_settings['address']
+        port = self.broker_settings['port']
+        protocol_name = str(self.broker_settings.get('protocol', '3.1.1'))
+        if protocol_name not in MQTT_PROTOCOLS:
+            self.log_message(f"⚠️ Unknown MQTT protocol '{protocol_name}', using 3.1.1")
+            protocol_name = '3.1.1'
+        
+        # Create a new client instance
+        if self.client:
+            self.client.loop_stop()
+            self.client.disconnect()
+            
+        self.protocol = MQTT_PROTOCOLS[protocol_name]
+        # Below MQTT 5 the broker cannot hold back retained messages, so drop them here
+        self.ignore_retained = self.protocol != mqtt.MQTTv5 and self.broker_settings.get('retain_handling', 0) == 2
+        self.client = mqtt.Client(client_id=self.client_id(), protocol=self.protocol)
+        self.subscriptions.reset()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        
+        try:
+            self.client.connect(broker, port, 60)
+            self.client.loop_start()
+            self.connected = True
+            return True
+        except Exception as e:
+            self.log_message(f"Connection failed: {str(e)}")
+            self.set_status("Connection failed")
+            return False
+    
+    def disconnect_mqtt(self):
+        if self.client:
+            self.client.loop_stop()
+            self.client.disconnect()
+        self.connected = False
+        self.set_status("⭕ Disconnected", "red")
+        self.log_message("Disconnected from broker")
+    
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        # MQTT 5 passes the result as a ReasonCode and adds the CONNACK properties
+        if rc == 0:
+            # Also set on paho's automatic reconnects
+            self.connected = True
+            self.set_status(f"✅ Connected to {self.broker_settings['address']}:{self.broker_settings['port']}", "green")
+            self.log_message("Connected to MQTT broker")
+            # A clean session starts without subscriptions
+            self.subscriptions.reset()
+            self.update_mqtt_subscriptions()
+        else:
+            conn_results = {
+                1: "Incorrect protocol version",
+                2: "Invalid client identifier", 
+                3: "Server unavailable",
+                4: "Bad username or password",
+                5: "Not authorized"
+            }
+            if isinstance(rc, int):
+                reason = conn_results.get(rc, f"Unknown error code {rc}")
+            else:
+                reason = str(rc)
+            self.connected = False
+            self.set_status(f"❌ Connection failed: {reason}", "red")
+            self.log_message(f"Connection failed: {reason}")
+    
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        self.connected = False
+        if rc != 0:
+            self.log_message("Unexpected disconnection")
+            self.set_status("⚠️ Unexpectedly disconnected", "orange")
+    
+    def on_message(self, client, userdata, msg):
+        received = time.perf_counter()
+        metrics = self.metrics
+        metrics.inc('messages_received')
+        sampled = self.spans.every and self.spans.tick()
+        if self.ignore_retained and msg.retain:
+            return  # retain_handling 2: no replay of retained messages on subscribe
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.record(msg.topic, msg.payload)
+        try:
+            topic = msg.topic
+            timestamp = datetime.now().strftime("%H:%M:%S")
+            
+            # Decoded forms of the payload are shared by all matching mappings,
+            # and only computed when a log line or trigger needs them
+            view = PayloadView(None, msg.payload, received)
+            
+            # Log the received message
+            self.log_message(f"📨 [{timestamp}] {topic} → {view.display}")
+            if sampled:
+                view.sampled = True
+                stamp = self.observe_stage('log', received)
+            
+            # Check for matching UDP mappings
+            previous = _UNSET
+            routes = self.topic_index.match(topic)
+            if sampled:
+                stamp = self.observe_stage('match', stamp)
+            for route in routes:
+                mapping = route.mapping
+                metrics.inc('matches', mapping['topic'])
+                
+                # Edge and change modes compare with the last payload on this topic,
+                # which is looked up and replaced once per message
+                if route.mode != 'level' and previous is _UNSET:
+                    previous = self.last_values.swap(topic, view.last_value)
+                
+                # Check if we should trigger based on the payload value
+                fired = route.fires(view, None if previous is _UNSET else previous)
+                if sampled:
+                    stamp = self.observe_stage('trigger', stamp)
+                if fired:
+                    metrics.inc('triggers', mapping['topic'])
+                    if self.udp_sending_enabled:
+                        # Get delay for this mapping
+                        udp_delay = mapping.get('udp_delay', 0.0)
+                        if udp_delay > 0:
+                            self.log_message(f"⏱️ Scheduling UDP send in {udp_delay:.1f}s to {route.destinations_text}")
+                            # Schedule UDP send with delay
+                            self.scheduler.schedule(udp_delay, id(mapping), self.dispatcher.submit, self.send_udp, route, topic, view)
+                        else:
+                            # Hand off to the sender pool
+                            if sampled:
+                                view.dispatched = time.perf_counter()
+                            self.dispatcher.submit(self.send_udp, route, topic, view)
+                        if sampled:
+                            stamp = self.observe_stage('dispatch', stamp)
+                    else:
+                        metrics.inc('suppressed', mapping['topic'])
+                        self.log_message(f"🚫 UDP disabled - would send to {route.destinations_text}")
+                elif route.mode != 'level':
+                    metrics.inc('suppressed', mapping['topic'])
+                    self.log_message(f"🔁 No {route.mode} trigger - payload '{view.display}' on {topic}")
+                else:
+                    metrics.inc('suppressed', mapping['topic'])
+                    self.log_message(f"🔕 No trigger - payload '{view.display}' != trigger value '{route.trigger.value}'")
+                    
+        except Exception as e:
+            self.log_message(f"Error processing message: {str(e)}")
+    
+    def topic_matches(self, pattern, topic):
+        """Check if topic matches pattern (supports MQTT wildcards + and #)"""
+        return topic_matches(pattern, topic)
+    
+    def should_trigger(self, payload, trigger_value):
+        """Check if the payload should trigger UDP sending"""
+        return compile_trigger(trigger_value).matches(PayloadView(payload))
+    
+    def send_udp(self, route, topic, view):
+        try:
+            if view.sampled:
+                stamp = time.perf_counter()
+                if view.dispatched is not None and route.mapping.get('udp_delay', 0.0) <= 0:
+                    self.observe_stage('queue', view.dispatched, stamp)
+            
+            # Render the precompiled UDP message
+            data = route.template.render(topic, view)
+            if view.sampled:
+                self.observe_stage('render', stamp)
+            self.send_data(route, view, data)
+        except Exception as e:
+            self.metrics.inc('send_errors', route.mapping['topic'])
+            self.log_message(f"❌ UDP send error: {str(e)}")
+    
+    def send_data(self, route, view, data):
+        """Send a rendered message through the mapping's rate limit"""
+        if route.rate_limit is not None and not self.rate_gate(route.rate_limit, ('mapping', id(route.mapping)), route,
+                                                                 self.send_data, route, view, data):
+            return
+        self.send_rendered(route, view, data, route.destinations)
+    
+    def send_rendered(self, route, view, data, destinations, attempt=0):
+        """Send a rendered message to destinations, each through its own rate limit
+        and circuit breaker; attempt counts the retries of this send so far"""
+        mapping = route.mapping
+        try:
+            if self.destination_limits:
+                destinations = tuple(destination for destination in destinations
+                                     if destination not in self.destination_limits
+                                     or self.rate_gate(self.destination_limits[destination], ('destination', destination), route,
+                                                       self.send_rendered, route, view, data, (destination,), attempt))
+                if not destinations:
+                    return
+            
+            # After the rate limits, so a let-through trial send is not then held back
+            breakers = self.breakers
+            if breakers:
+                allowed = tuple(destination for destination in destinations if breakers.allow(destination))
+                if len(allowed) < len(destinations):
+                    skipped = [destination for destination in destinations if destination not in allowed]
+                    self.metrics.inc('circuit_open', mapping['topic'], len(skipped))
+                    self.log_message(f"⛔ Circuit open - skipped {format_destinations(skipped)}")
+                    destinations = allowed
+                    if not destinations:
+                        return
+            
+            # Send UDP message over the pooled socket for a single destination,
+            # or to all destinations in one batch
+            if view.sampled:
+                stamp = time.perf_counter()
+            if len(destinations) == 1:
+                try:
+                    self.udp_sender.send(destinations[0][0], destinations[0][1], data)
+                    failures = ()
+                except OSError as e:
+                    failures = ((destinations[0], e),)
+            else:
+                failures = self.udp_sender.send_many(destinations, data)
+            
+            for destination, error in failures:
+                self.metrics.inc('send_errors', mapping['topic'])
+                self.log_message(f"❌ UDP send error to {format_destinations([destination])}: {str(error)}")
+                if breakers.failure(destination):
+                    self.log_message(f"⛔ Circuit opened for {format_destinations([destination])} "
+                                     f"after {breakers.threshold} failures, retrying it in {breakers.reset:g}s")
+                if route.retry is not None and retriable(error):
+                    self.schedule_retry(route, view, data, destination, attempt)
+            if breakers:
+                failed = {destination for destination, _ in failures}
+                for destination in destinations:
+                    if destination not in failed:
+                        breakers.success(destination)
+            if view.sampled:
+                stamp = self.observe_stage('sendto', stamp)
+            if len(failures) == len(destinations):
+                return
+            self.record_send(route, view, len(destinations) - len(failures))
+            
+            timestamp = datetime.now().strftime("%H:%M:%S")
+            template = route.template
+            if template.constant is not None:
+                udp_message = template.text
+            elif template.passthrough:
+                udp_message = view.display
+            else:
+                udp_message = data.decode('utf-8', 'replace')
+            destinations_text = route.destinations_text if destinations is route.destinations else format_destinations(destinations)
+            self.log_message(f"🚀 [{timestamp}] UDP → {destinations_text} → {udp_message}")
+            if view.sampled:
+                self.observe_stage('send_log', stamp)
+            
+        except Exception as e:
+            self.metrics.inc('send_errors', mapping['topic'])
+            self.log_message(f"❌ UDP send error: {str(e)}")
+    
+    def schedule_retry(self, route, view, data, destination, attempt):
+        """Queue another attempt of a failed send after the mapping's backoff, unless it ran out of attempts"""
+        topic = route.mapping['topic']
+        target = format_destinations([destination])
+        if attempt >= route.retry.attempts:
+            self.metrics.inc('retry_dropped', topic)
+            self.log_message(f"🪦 Giving up on {target} for {topic} after {attempt} retries")
+            return
+        seq, evicted = self.retry_queue.add((route, view, data, destination, attempt + 1))
+        if evicted is not None:
+            self.metrics.inc('retry_dropped', evicted[0].mapping['topic'])
+            self.log_message(f"🧺 Retry queue full - dropped the oldest retry (for {evicted[0].mapping['topic']})")
+        if seq is None:
+            self.metrics.inc('retry_dropped', topic)
+            self.log_message(f"🧺 Retry queue full - not retrying {target} for {topic}")
+            return
+        self.scheduler.schedule(route.retry.delay(attempt + 1), ('retry', id(route.mapping)), self.fire_retry, seq)
+    
+    def fire_retry(self, seq):
+        """Scheduler callback: hand a due retry to the sender pool"""
+        entry = self.retry_queue.take(seq)
+        if entry is None:
+            return  # Dropped on overflow or when sending was disabled
+        route, view, data, destination, attempt = entry
+        if self.routes.get(id(route.mapping)) is not route or not self.udp_sending_enabled:
+            return  # Mapping edited or removed meanwhile
+        self.metrics.inc('retries', route.mapping['topic'])
+        self.log_message(f"🔂 Retry {attempt}/{route.retry.attempts} to {format_destinations([destination])}")
+        self.dispatcher.submit(self.send_rendered, route, view, data, (destination,), attempt)
+    
+    def rate_gate(self, limit, key, route, func, *args):
+        """Take a token from limit; returns False when the send must not go out now.
+        
+        Refused sends are dropped, or with the 'coalesce' policy parked under
+        key, replacing any older parked send, and retried with func(*args)
+        once the bucket has refilled.
+        """
+        wait = limit.take()
+        if wait <= 0:
+            return True
+        
+        topic = route.mapping['topic']
+        if limit.overflow == 'coalesce':
+            with self._coalesce_lock:
+                replaced = key in self._coalesced
+                self._coalesced[key] = (func, args)
+            if replaced:
+                self.metrics.inc('coalesced', topic)
+                self.log_message(f"🧯 Rate limit - coalesced older message for {topic}")
+            else:
+                self.scheduler.schedule(wait, key, self.flush_coalesced, key)
+        else:
+            self.metrics.inc('rate_limited', topic)
+            self.log_message(f"🚦 Rate limit - dropped message for {topic}")
+        return False
+    
+    def flush_coalesced(self, key):
+        """Scheduler callback: hand the latest parked send for key to the sender pool"""
+        with self._coalesce_lock:
+            entry = self._coalesced.pop(key, None)
+        if entry is not None:
+            func, args = entry
+            self.dispatcher.submit(func, *args)
+    
+    def cancel_pending(self):
+        """Drop delayed and coalesced sends, returns how many were dropped"""
+        cancelled = self.scheduler.cancel_all()
+        with self._coalesce_lock:
+            self._coalesced.clear()
+        self.retry_queue.clear()
+        return cancelled
+    
+    def observe_stage(self, stage, since, now=None):
+        """Record the time spent in a stage of a sampled message, returns the end of the stage"""
+        if now is None:
+            now = time.perf_counter()
+        self.metrics.observe('stage_seconds', now - since, stage)
+        return now
+    
+    def configure_profiling(self):
+        """Apply the stage timing sample rate"""
+        try:
+            self.spans.set_rate(self.profiling_settings['sample_rate'])
+        except (TypeError, ValueError):
+            self.log_message("⚠️ Profiling sample_rate must be a number between 0 and 1")
+            self.spans.set_rate(0.0)
+    
+    def capture_profile(self, seconds=None, path=None):
+        """Sample every thread's stack for a while into a folded-stacks file, returns the capture or None"""
+        if self.profile_capture is not None and self.profile_capture.running():
+            self.log_message("⚠️ A profile capture is already running")
+            return None
+        settings = self.profiling_settings
+        if seconds is None:
+            seconds = float(settings['capture_seconds'])
+        if path is None:
+            directory = os.path.dirname(os.path.abspath(self.mappings_file))
+            path = os.path.join(directory, f"mqtt_udp_profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded")
+        
+        def done(path, samples, error):
+            if error is not None:
+                self.log_message(f"❌ Could not write profile {path}: {str(error)}")
+            else:
+                self.log_message(f"🔬 Profile written to {path} ({samples} samples)")
+        
+        self.log_message(f"🔬 Profiling all threads for {seconds:g}s")
+        self.profile_capture = ProfileCapture(path, seconds, float(settings['capture_interval']), done)
+        return self.profile_capture
+    
+    def record_send(self, route, view, count=1):
+        """Count successful sends and their receive-to-send latency"""
+        self.metrics.inc('sends', route.mapping['topic'], count)
+        if view.received is not None:
+            latency = time.perf_counter() - view.received
+            # For delayed sends only the slippage past udp_delay is of interest
+            udp_delay = route.mapping.get('udp_delay', 0.0)
+            if udp_delay > 0:
+                self.metrics.observe('send_latency_seconds', max(0.0, latency - udp_delay), 'delayed')
+            else:
+                self.metrics.observe('send_latency_seconds', latency, 'immediate')
+    
+    def configure_resolver(self):
+        """Apply the resolver settings: TTL, retry interval and hosts overrides"""
+        resolver = self.udp_sender.resolver
+        resolver.log = self.log_message
+        try:
+            resolver.ttl = float(self.resolver_settings['ttl'])
+            resolver.retry = float(self.resolver_settings['retry'])
+        except (TypeError, ValueError):
+            self.log_message("⚠️ Resolver ttl and retry must be numbers (seconds)")
+        hosts = {}
+        hosts_file = self.resolver_settings.get('hosts_file')
+        if hosts_file:
+            try:
+                hosts.update(parse_hosts_file(hosts_file))
+            except OSError as e:
+                self.log_message(f"❌ Cannot read hosts file {hosts_file}: {str(e)}")
+        hosts.update(self.resolver_settings.get('hosts') or {})
+        resolver.set_hosts(hosts)
+    
+    def configure_ingress(self):
+        """Bind the UDP ports of the ingress mappings (only the ones that changed)"""
+        routes = []
+        for mapping in self.ingress_mappings:
+            try:
+                routes.append(IngressRoute(mapping))
+            except ValueError as e:
+                self.log_message(f"⚠️ Ignoring ingress mapping {mapping.get('listen_port', '?')} → {mapping.get('mqtt_topic', '?')}: {str(e)}")
+        self.ingress.configure(routes)
+    
+    def publish_ingress(self, batch):
+        """Publish datagrams parsed by the ingress loop, one batch per select() pass"""
+        client = self.client
+        metrics = self.metrics
+        if not (client and self.connected):
+            for route, _, _, _ in batch:
+                metrics.inc('ingress_dropped', route.label)
+            self.log_message(f"🚫 Not connected - dropped {len(batch)} UDP datagram(s) for MQTT")
+            return
+        
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        for route, topic, payload, source in batch:
+            try:
+                info = client.publish(topic, payload, qos=route.qos, retain=route.retain)
+            except ValueError as e:
+                # A captured field made the topic empty or put a wildcard in it
+                metrics.inc('ingress_dropped', route.label)
+                self.log_message(f"❌ Invalid MQTT topic '{topic}' from UDP {source[0]}:{source[1]}: {str(e)}")
+                continue
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                metrics.inc('ingress_published', route.label)
+                self.log_message(f"📤 [{timestamp}] UDP {source[0]}:{source[1]} → MQTT {topic} → {payload}")
+            else:
+                metrics.inc('ingress_dropped', route.label)
+                self.log_message(f"❌ MQTT publish error for {topic}: {mqtt.error_string(info.rc)}")
+    
+    def count_unmatched_ingress(self, label, count):
+        self.metrics.inc('ingress_unmatched', label, count)
+    
+    def log_message(self, message):
+        """Queue a log line (safe to call from any thread)"""
+        self.log_pipeline.push(message)
+    
+    def set_udp_enabled(self, enabled):
+        """Enable or disable UDP sending, dropping pending delayed sends when disabled"""
+        self.udp_sending_enabled = enabled
+        if not enabled:
+            cancelled = self.cancel_pending()
+            if cancelled:
+                self.log_message(f"🚫 UDP disabled - cancelled {cancelled} pending delayed sends")
+    
+    def stats(self):
+        """Sender, queue and scheduler statistics"""
+        return {
+            'sender': self.udp_sender.stats(),
+            'queue': self.dispatcher.stats(),
+            'delayed': self.scheduler.stats(),
+            'last_values': self.last_values.stats(),
+            'coalesced_pending': len(self._coalesced),
+            'ingress': {'ports': len(self.ingress.addresses()), 'received': self.ingress.received},
+            'resolver': self.udp_sender.resolver.stats(),
+            'retry': {'pending': len(self.retry_queue), 'dropped': self.retry_queue.dropped,
+                      'circuits_open': self.breakers.open_count()},
+        }
+    
+    def render_metrics(self):
+        """All metrics in Prometheus text format"""
+        stats = self.stats()
+        gauges = {
+            'mappings': ("Configured mappings", len(self.udp_mappings)),
+            'connected': ("1 while connected to the broker", int(self.connected)),
+            'send_queue_depth': ("Sends waiting for a sender thread", stats['queue']['depth']),
+            'send_queue_dropped': ("Sends dropped by the queue overflow policy", stats['queue']['dropped']),
+            'delayed_pending': ("Delayed sends waiting to fire", stats['delayed']['pending']),
+            'delayed_max_lateness_seconds': ("Worst delayed send lateness", stats['delayed']['max_lateness']),
+            'sockets_open': ("Pooled UDP sockets", stats['sender']['sockets_open']),
+            'sockets_created': ("UDP sockets created", stats['sender']['sockets_created']),
+            'last_value_topics': ("Topics in the edge/change trigger cache", stats['last_values']['topics']),
+            'coalesced_pending': ("Rate-limited sends waiting to be coalesced", stats['coalesced_pending']),
+            'ingress_ports': ("UDP ports listened on for ingress", stats['ingress']['ports']),
+            'ingress_datagrams': ("UDP datagrams received for ingress", stats['ingress']['received']),
+            'last_value_evictions': ("Topics evicted from the edge/change trigger cache", stats['last_values']['evictions']),
+            'resolver_cached': ("Destination addresses in the resolver cache", stats['resolver']['cached']),
+            'resolver_refresh_failures': ("Hostname lookups that failed", stats['resolver']['failures']),
+            'resolver_unresolved': ("Destination hostnames that never resolved, retried in the background", stats['resolver']['unresolved']),
+            'retry_pending': ("Failed sends waiting for a retry", stats['retry']['pending']),
+            'circuits_open': ("Destinations whose circuit breaker is open", stats['retry']['circuits_open']),
+        }
+        return self.metrics.render_prometheus(gauges)
+    
+    def start_metrics_server(self):
+        """Serve render_metrics() over HTTP if enabled in the metrics settings"""
+        if not self.metrics_settings.get('enabled') or self.metrics_server:
+            return
+        try:
+            self.metrics_server = MetricsServer(self.render_metrics, self.metrics_settings['address'], int(self.metrics_settings['port']))
+            self.log_message(f"📈 Metrics at {self.metrics_server.url}")
+        except (OSError, ValueError) as e:
+            self.log_message(f"❌ Could not start metrics endpoint: {str(e)}")
+    
+    def start_recording(self, path):
+        """Record every received MQTT message to path, returns True on success"""
+        self.stop_recording()
+        try:
+            self.recorder = Recorder(path)
+        except (OSError, ValueError) as e:
+            self.log_message(f"❌ Cannot record to {path}: {str(e)}")
+            return False
+        self.log_message(f"⏺️ Recording MQTT traffic to {path}")
+        return True
+    
+    def stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is None:
+            return
+        recorder.close()
+        stats = recorder.stats()
+        self.log_message(f"⏹️ Recorded {stats['records']} messages on {stats['topics']} topics "
+                         f"({stats['bytes']} bytes) to {recorder.path}, {stats['dropped']} dropped")
+    
+    def load_mappings(self, rebuild_index=True):
+        """Load UDP mappings and broker settings from JSON file"""
+        self.config_stamp = file_stamp(self.mappings_file)
+        digest = None
+        try:
+            if os.path.exists(self.mappings_file):
+                with open(self.mappings_file, 'rb') as f:
+                    raw = f.read()
+                
+                # A compiled snapshot of exactly this content skips parsing and indexing
+                digest = hashlib.sha256(raw).hexdigest()
+                if rebuild_index and self.load_snapshot(digest):
+                    self.rebuild_destination_limits()
+                    return
+                mappings, settings = self.read_config(json.loads(raw))
+            else:
+                mappings, settings = [], default_settings()
+                print(f"No existing mappings file found. Starting with empty mappings.")
+        except Exception as e:
+            print(f"Error loading mappings: {str(e)}")
+            mappings, settings = [], default_settings()
+        
+        self.udp_mappings = mappings
+        for name, value in settings.items():
+            setattr(self, name, value)
+        self.rebuild_destination_limits()
+        if rebuild_index:
+            self.rebuild_topic_index()
+            if digest is not None and len(self.udp_mappings) >= SNAPSHOT_MIN_MAPPINGS:
+                self.write_snapshot(digest)
+    
+    def read_config(self, data):
+        """Normalise the parsed mappings file into (mappings, settings) without
+        touching the running config; settings are keyed by attribute name, as
+        in SNAPSHOT_SETTINGS. Raises ValueError if the file is malformed.
+        """
+        settings = default_settings()
+        
+        # Handle both old format (just mappings list) and new format (dict with mappings and broker)
+        if isinstance(data, list):
+            mappings_data = data
+        elif isinstance(data, dict):
+            # New format - mappings and broker settings
+            mappings_data = data.get('mappings', [])
+            
+            broker_data = data.get('broker', settings['broker_settings'])
+            # Ensure auto_connect key exists
+            if 'auto_connect' not in broker_data:
+                broker_data['auto_connect'] = True
+            settings['broker_settings'] = broker_data
+            
+            # Sender pool settings (applied on startup)
+            sender_settings = settings['sender_settings']
+            sender_settings.update(data.get('sender', {}))
+            if sender_settings['overflow'] not in OVERFLOW_POLICIES:
+                print(f"Unknown overflow policy '{sender_settings['overflow']}', using '{DEFAULT_SENDER_SETTINGS['overflow']}'")
+                sender_settings['overflow'] = DEFAULT_SENDER_SETTINGS['overflow']
+            
+            # Retry queue and circuit breaker settings (applied on startup)
+            settings['retry_settings'].update(data.get('retry', {}))
+            
+            # Hostname cache TTL and hosts overrides for destinations
+            settings['resolver_settings'].update(data.get('resolver', {}))
+            
+            # Metrics endpoint settings (applied on startup)
+            settings['metrics_settings'].update(data.get('metrics', {}))
+            
+            # Stage timing sample rate and profile capture settings
+            settings['profiling_settings'].update(data.get('profiling', {}))
+            
+            # Last-value cache size for edge/change triggers (applied on startup)
+            settings['trigger_settings'].update(data.get('triggers', {}))
+            
+            # Rate limits keyed by "host:port"
+            settings['destination_limit_settings'] = data.get('destination_limits', {})
+            
+            # UDP -> MQTT mappings
+            settings['ingress_mappings'] = data.get('ingress', [])
+        else:
+            raise ValueError("Invalid file format")
+        
+        mappings = []
+        for number, mapping in enumerate(mappings_data, 1):
+            try:
+                if not isinstance(mapping.get('topic'), str) or not isinstance(mapping.get('udp_message'), str):
+                    raise ValueError("needs a topic and a udp_message")
+                if 'trigger_value' not in mapping:
+                    mapping['trigger_value'] = ''  # Default to trigger on any value
+                if 'udp_delay' not in mapping:
+                    mapping['udp_delay'] = 0.0  # Default to no delay
+                if mapping.get('trigger_mode') not in TRIGGER_MODES:
+                    mapping['trigger_mode'] = 'level'  # Default to every matching payload
+                # Single udp_ip/udp_port mappings become a one-entry destinations list
+                set_destinations(mapping, mapping_destinations(mapping))
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Mapping {number} ({mapping.get('topic') if isinstance(mapping, dict) else mapping!r}): "
+                                 f"{'missing ' + str(e) if isinstance(e, KeyError) else str(e)}") from None
+            mappings.append(mapping)
+        
+        if isinstance(data, list):
+            print(f"Loaded {len(mappings)} mappings from {self.mappings_file} (old format)")
+        else:
+            print(f"Loaded {len(mappings)} mappings and broker settings from {self.mappings_file}")
+        return mappings, settings
+    
+    def snapshot_file(self):
+        return self.mappings_file + '.cache'
+    
+    def load_snapshot(self, digest):
+        """Restore settings, mappings and topic index from the snapshot of the
+        config with this content digest, returns True on success"""
+        path = self.snapshot_file()
+        try:
+            with open(path, 'rb') as f:
+                header = pickle.load(f)
+                if header != {'version': SNAPSHOT_VERSION, 'digest': digest}:
+                    return False  # Stale; rebuilt after this load
+                with gc_paused():
+                    snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Ignoring config snapshot {path}: {str(e)}")
+            return False
+        
+        for name, value in snapshot['settings'].items():
+            setattr(self, name, value)
+        self.udp_mappings = snapshot['mappings']
+        self.routes = {id(route.mapping): route for route in snapshot['routes']}
+        self.topic_index = snapshot['topic_index']
+        self.mappings_by_topic = {mapping['topic']: mapping for mapping in self.udp_mappings}
+        print(f"Loaded {len(self.udp_mappings)} mappings and broker settings from snapshot {path}")
+        return True
+    
+    def write_snapshot(self, digest):
+        """Save the loaded settings, mappings and topic index for the next start"""
+        path = self.snapshot_file()
+        header = {'version': SNAPSHOT_VERSION, 'digest': digest}
+        snapshot = {
+            'settings': {name: getattr(self, name) for name in SNAPSHOT_SETTINGS},
+            'mappings': self.udp_mappings,
+            'routes': list(self.routes.values()),
+            'topic_index': self.topic_index,
+        }
+        
+        def write(f):
+            # The header alone tells a later load whether the rest is worth reading
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            with gc_paused():
+                pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+        
+        started = time.perf_counter()
+        try:
+            write_atomic(path, write, binary=True)
+        except Exception as e:
+            print(f"Could not write config snapshot {path}: {str(e)}")
+            return
+        print(f"Wrote config snapshot {path} in {time.perf_counter() - started:.1f}s")
+    
+    def rebuild_destination_limits(self):
+        """Build the per-destination rate limits from destination_limit_settings"""
+        limits = {}
+        for text, settings in self.destination_limit_settings.items():
+            try:
+                destinations = parse_destinations(text)
+            except ValueError as e:
+                print(f"Ignoring rate limit for '{text}': {str(e)}")
+                continue
+            for destination in destinations:
+                # One bucket per destination, even when they share a settings entry
+                limit = make_rate_limit(settings)
+                if limit is not None:
+                    limits[destination] = limit
+        self.destination_limits = limits
+    
+    def rebuild_topic_index(self):
+        """Rebuild the topic index used by on_message from the current mappings"""
+        # Build the new index off to the side and swap it in with one assignment,
+        # so the MQTT thread never sees a half-built index
+        with gc_paused():
+            routes = {id(mapping): MappingRoute(mapping) for mapping in self.udp_mappings}
+            self.topic_index = TopicIndex((mapping['topic'], routes[id(mapping)]) for mapping in self.udp_mappings)
+        self.routes = routes
+        self.mappings_by_topic = {mapping['topic']: mapping for mapping in self.udp_mappings}
+    
+    def index_mapping(self, mapping, route=None):
+        """Add one mapping (and its route, if already built) to the topic index and the topic lookup"""
+        route = self.routes[id(mapping)] = route or MappingRoute(mapping)
+        self.topic_index.add(mapping['topic'], route)
+        self.mappings_by_topic[mapping['topic']] = mapping
+    
+    def unindex_mapping(self, mapping):
+        """Take one mapping out of the topic index and drop its pending sends"""
+        route = self.routes.pop(id(mapping), None)
+        if route is not None:
+            self.topic_index.remove(mapping['topic'], route)
+        if self.mappings_by_topic.get(mapping['topic']) is mapping:
+            del self.mappings_by_topic[mapping['topic']]
+        self.scheduler.cancel(id(mapping))
+        self.scheduler.cancel(('mapping', id(mapping)))
+        with self._coalesce_lock:
+            self._coalesced.pop(('mapping', id(mapping)), None)
+    
+    def insert_mapping(self, mapping):
+        """Add a mapping without rebuilding the index"""
+        self.udp_mappings.append(mapping)
+        self.index_mapping(mapping)
+    
+    def delete_mappings(self, mappings):
+        """Remove mappings without rebuilding the index"""
+        ids = set()
+        for mapping in mappings:
+            self.unindex_mapping(mapping)
+            ids.add(id(mapping))
+        self.udp_mappings = [m for m in self.udp_mappings if id(m) not in ids]
+    
+    def diff_mappings(self, old_mappings, new_mappings):
+        """Match new_mappings against old_mappings without changing anything.
+        
+        Mappings that are unchanged keep their old objects, so their routes,
+        rate limits and pending delayed sends carry on untouched. Returns
+        (merged, added, removed): the new mapping list built that way, and
+        the added and removed (or edited) mappings.
+        """
+        def key(mapping):
+            return json.dumps(mapping, sort_keys=True)
+        
+        unchanged = {}
+        for mapping in old_mappings:
+            unchanged.setdefault(key(mapping), []).append(mapping)
+        
+        merged = []
+        added = []
+        for mapping in new_mappings:
+            same = unchanged.get(key(mapping))
+            if same:
+                merged.append(same.pop(0))
+            else:
+                merged.append(mapping)
+                added.append(mapping)
+        removed = [mapping for mappings in unchanged.values() for mapping in mappings]
+        return merged, added, removed
+    
+    def apply_mapping_diff(self, merged, added, removed, routes):
+        """Update the live topic index to a diff_mappings result in place.
+        
+        Only added and removed mappings touch the index; lookups running on
+        the MQTT thread meanwhile see either the old or the new entry.
+        routes holds the prebuilt MappingRoute of each added mapping by id.
+        """
+        for mapping in removed:
+            self.unindex_mapping(mapping)
+        for mapping in added:
+            self.index_mapping(mapping, routes[id(mapping)])
+        self.udp_mappings = merged
+    
+    def save_mappings(self):
+        """Save UDP mappings and broker settings to JSON file"""
+        try:
+            self.save_due = None
+            data = {
+                'broker': self.broker_settings,
+                'sender': self.sender_settings,
+                'retry': self.retry_settings,
+                'resolver': self.resolver_settings,
+                'metrics': self.metrics_settings,
+                'profiling': self.profiling_settings,
+                'triggers': self.trigger_settings,
+                'destination_limits': self.destination_limit_settings,
+                'ingress': self.ingress_mappings,
+                'mappings': self.udp_mappings
+            }
+            write_json_atomic(self.mappings_file, data)
+            self.config_stamp = file_stamp(self.mappings_file)
+            print(f"Saved {len(self.udp_mappings)} mappings and broker settings to {self.mappings_file}")
+        except Exception as e:
+            print(f"Error saving mappings: {str(e)}")
+            self.log_message(f"❌ Error saving mappings: {str(e)}")
+    
+    def request_save(self):
+        """Save the mappings soon; a burst of edits is written once (see poll_config)"""
+        self.save_due = time.monotonic() + SAVE_DEBOUNCE_SECONDS
+    
+    def poll_config(self):
+        """Write a due debounced save, or reload the mappings file if it was edited externally.
+        
+        Call this periodically from the thread that owns the mappings (the
+        Tk loop, or the headless main loop).
+        """
+        now = time.monotonic()
+        if self.save_due is not None:
+            if now >= self.save_due:
+                if file_stamp(self.mappings_file) != self.config_stamp:
+                    self.log_message(f"⚠️ {self.mappings_file} changed on disk, overwriting it with the edits made here")
+                self.save_mappings()
+            return
+        
+        if now < self.next_config_check:
+            return
+        self.next_config_check = now + CONFIG_WATCH_INTERVAL
+        stamp = file_stamp(self.mappings_file)
+        if stamp is not None and stamp != self.config_stamp:
+            self.log_message(f"📝 {self.mappings_file} changed on disk, reloading")
+            self.reload_mappings()
+    
+    def reload_mappings(self):
+        """Reload mappings and broker settings from file, applying only what changed.
+        
+        Returns the (added, removed) mappings, or None if the file could not be used.
+        """
+        old_count = len(self.udp_mappings)
+        old_broker = f"{self.broker_settings['address']}:{self.broker_settings['port']}"
+        
+        # Parse the file and compile the changed mappings before touching anything,
+        # so a file that is mid-write or broken leaves the current config running
+        stamp = file_stamp(self.mappings_file)
+        try:
+            with open(self.mappings_file, 'r') as f:
+                mappings, settings = self.read_config(json.load(f))
+            merged, added, removed = self.diff_mappings(self.udp_mappings, mappings)
+            routes = {id(mapping): MappingRoute(mapping) for mapping in added}
+        except Exception as e:
+            self.config_stamp = stamp
+            self.log_message(f"❌ Not reloading {self.mappings_file}: {str(e)}")
+            return None
+        
+        self.config_stamp = stamp
+        for name, value in settings.items():
+            setattr(self, name, value)
+        self.rebuild_destination_limits()
+        self.apply_mapping_diff(merged, added, removed, routes)
+        self.update_mqtt_subscriptions()
+        self.configure_ingress()
+        self.configure_resolver()
+        self.configure_profiling()
+        
+        new_broker = f"{self.broker_settings['address']}:{self.broker_settings['port']}"
+        self.log_message(f"🔄 Reloaded: {old_count} → {len(self.udp_mappings)} mappings "
+                         f"(+{len(added)} / -{len(removed)}), broker: {old_broker} → {new_broker}")
+        return added, removed
+    
+    def shutdown(self):
+        """Disconnect from the broker and stop the sender threads"""
+        if self.client and self.connected:
+            self.client.loop_stop()
+            self.client.disconnect()
+        self.ingress.stop()
+        self.stop_recording()
+        if self.profile_capture is not None:
+            self.profile_capture.stop()
+        self.scheduler.stop()
+        self.dispatcher.stop()
+        self.udp_sender.close()
+        self.udp_sender.resolver.stop()
+        if self.metrics_server:
+            self.metrics_server.stop()
+
+
+def run_headless(mappings_file=DEFAULT_MAPPINGS_FILE, retry_interval=5.0, record_file=None):
+    """Run the bridge without a display until SIGINT/SIGTERM, logging to stdout"""
+    bridge = BridgeCore(mappings_file)
+    bridge.start_metrics_server()
+    if record_file:
+        bridge.start_recording(record_file)
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <pid> captures a profile of the running bridge
+        signal.signal(signal.SIGUSR1, lambda signum, frame: bridge.capture_profile())
+    
+    address = f"{bridge.broker_settings['address']}:{bridge.broker_settings['port']}"
+    print(f"Running headless with {len(bridge.udp_mappings)} mappings, broker {address}")
+    
+    # paho's network loop reconnects by itself once the first connect succeeded
+    started = False
+    next_attempt = 0.0
+    while not stop.is_set():
+        if not started and time.monotonic() >= next_attempt:
+            started = bridge.connect_mqtt()
+            next_attempt = time.monotonic() + retry_interval
+        bridge.poll_config()
+        for line in bridge.log_pipeline.drain():
+            print(line, flush=True)
+        stop.wait(0.2)
+    
+    bridge.shutdown()
+    for line in bridge.log_pipeline.drain():
+        print(line)
+    return 0
+
+
+def run_replay(mappings_file=DEFAULT_MAPPINGS_FILE, recording=None, speed=1.0):
+    """Route a recording through the mappings instead of live MQTT traffic, logging to stdout"""
+    bridge = BridgeCore(mappings_file)
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+    
+    pace = f"{speed:g}x" if speed > 0 else "full speed"
+    print(f"Replaying {recording} at {pace} through {len(bridge.udp_mappings)} mappings")
+    
+    # Print the log from another thread so the replay timing is not disturbed
+    done = threading.Event()
+    def print_log():
+        while not done.wait(0.2):
+            for line in bridge.log_pipeline.drain():
+                print(line, flush=True)
+    printer = threading.Thread(target=print_log, name='replay-log', daemon=True)
+    printer.start()
+    
+    started = time.monotonic()
+    try:
+        count = replay(bridge, recording, speed, stop)
+    except (OSError, ValueError) as e:
+        print(f"❌ Cannot replay {recording}: {str(e)}")
+        count = None
+    elapsed = time.monotonic() - started
+    
+    # Let delayed sends go out before stopping
+    while not stop.is_set() and bridge.scheduler.stats()['pending']:
+        stop.wait(0.1)
+    done.set()
+    printer.join()
+    bridge.shutdown()
+    for line in bridge.log_pipeline.drain():
+        print(line)
+    if count is None:
+        return 1
+    print(f"Replayed {count} messages in {elapsed:.2f}s")
+    return 0
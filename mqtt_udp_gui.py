@@ -0,0 +1,811 @@
+"""Tk user interface for the MQTT to UDP bridge"""
+import tkinter as tk
+from tkinter import ttk, scrolledtext, messagebox
+
+from mqtt_udp_ratelimit import RATE_OVERFLOW_POLICIES
+from mqtt_udp_core import (BridgeCore, DEFAULT_MAPPINGS_FILE, format_destinations, mapping_destinations,
+                           MQTT_PROTOCOLS, parse_destinations, set_destinations, TRIGGER_MODES)
+
+# Messages tab: refresh interval and number of lines kept in the widget
+LOG_FLUSH_INTERVAL_MS = 50
+LOG_MAX_LINES = 2000
+CONFIG_POLL_INTERVAL_MS = 100
+MAPPINGS_PAGE_SIZE = 500
+FILTER_DELAY_MS = 250
+
+
+class MQTTUDPBridge(BridgeCore):
+    def __init__(self, root, mappings_file=DEFAULT_MAPPINGS_FILE):
+        self.root = root
+        self.root.title("MQTT to UDP Bridge")
+        self.root.geometry("900x750")
+        self.root.minsize(700, 550)
+        
+        # Simple modern styling
+        self.setup_modern_theme()
+        
+        # Load mappings and start the routing core
+        super().__init__(mappings_file)
+        
+        self.create_widgets()
+        
+        # Update display with loaded mappings
+        self.update_mappings_display()
+        
+        # Auto-connect if enabled
+        if self.broker_settings.get('auto_connect', True):
+            self.root.after(3000, self.auto_connect)
+        
+        # Refresh sender statistics and metrics once a second
+        self.last_totals = None
+        self.update_stats_display()
+        
+        # Write queued log lines to the Messages tab at a fixed rate
+        self.flush_log()
+        
+        # Debounced saves and hot reload of the mappings file
+        self.watch_config()
+        
+        # Prometheus endpoint on localhost
+        self.start_metrics_server()
+        
+    def setup_modern_theme(self):
+        """Configure clean modern styling"""
+        style = ttk.Style()
+        style.theme_use('clam')
+        
+        # Configure modern styles
+        style.configure('Title.TLabel', font=('Segoe UI', 12, 'bold'))
+        style.configure('Heading.TLabel', font=('Segoe UI', 10, 'bold'))
+        style.configure('Info.TLabel', font=('Segoe UI', 8))
+        
+        # Button styles
+        style.configure('Accent.TButton', font=('Segoe UI', 9, 'bold'))
+        
+    def create_widgets(self):
+        # Create notebook for tabs
+        notebook = ttk.Notebook(self.root)
+        notebook.pack(fill="both", expand=True, padx=10, pady=10)
+        
+        # MQTT Connection tab
+        self.create_mqtt_tab(notebook)
+        
+        # UDP Mappings tab
+        self.create_udp_mappings_tab(notebook)
+        
+        # Messages/Log tab
+        self.create_messages_tab(notebook)
+        
+        # Status bar: connection status on the left, live metrics on the right
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=2)
+        self.status_var = tk.StringVar()
+        self.status_var.set("⭕ Disconnected")
+        self.status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        self.status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.metrics_var = tk.StringVar()
+        ttk.Label(status_frame, textvariable=self.metrics_var, relief=tk.SUNKEN, anchor=tk.E).pack(side=tk.RIGHT)
+        
+    def create_mqtt_tab(self, notebook):
+        mqtt_frame = ttk.Frame(notebook)
+        notebook.add(mqtt_frame, text="MQTT Connection")
+        
+        # Connection settings
+        conn_frame = ttk.LabelFrame(mqtt_frame, text="MQTT Broker Settings", padding=10)
+        conn_frame.pack(fill="x", padx=15, pady=15)
+        
+        # Broker
+        ttk.Label(conn_frame, text="Broker:").grid(row=0, column=0, padx=5, pady=8, sticky="w")
+        self.broker_entry = ttk.Entry(conn_frame, width=30, font=('Segoe UI', 9))
+        self.broker_entry.insert(0, self.broker_settings['address'])
+        self.broker_entry.grid(row=0, column=1, padx=5, pady=8, sticky="ew")
+        
+        # Port
+        ttk.Label(conn_frame, text="Port:").grid(row=0, column=2, padx=5, pady=8, sticky="w")
+        self.port_entry = ttk.Entry(conn_frame, width=10, font=('Segoe UI', 9))
+        self.port_entry.insert(0, str(self.broker_settings['port']))
+        self.port_entry.grid(row=0, column=3, padx=5, pady=8, sticky="w")
+        
+        # Protocol version and shared subscription group (applied on connect)
+        ttk.Label(conn_frame, text="Protocol:").grid(row=1, column=0, padx=5, pady=8, sticky="w")
+        protocol_frame = ttk.Frame(conn_frame)
+        protocol_frame.grid(row=1, column=1, columnspan=3, padx=5, pady=8, sticky="w")
+        self.protocol_var = tk.StringVar(value=str(self.broker_settings.get('protocol', '3.1.1')))
+        ttk.Combobox(protocol_frame, textvariable=self.protocol_var, values=list(MQTT_PROTOCOLS), state="readonly",
+                     width=8).pack(side="left")
+        ttk.Label(protocol_frame, text="Share group:").pack(side="left", padx=(15, 5))
+        self.share_group_entry = ttk.Entry(protocol_frame, width=20, font=('Segoe UI', 9))
+        self.share_group_entry.insert(0, self.broker_settings.get('share_group', ''))
+        self.share_group_entry.pack(side="left")
+        
+        # Connect button and status
+        button_frame = ttk.Frame(conn_frame)
+        button_frame.grid(row=2, column=0, columnspan=4, pady=15, sticky="w")
+        
+        self.connect_button = ttk.Button(button_frame, text="🔌 Connect", command=self.toggle_connection, style='Accent.TButton')
+        self.connect_button.pack(side="left", padx=(0, 15))
+        
+        # Auto-connect checkbox
+        self.auto_connect_var = tk.BooleanVar(value=self.broker_settings.get('auto_connect', True))
+        ttk.Checkbutton(button_frame, text="Auto-connect on startup", variable=self.auto_connect_var, 
+                       command=self.save_auto_connect_setting).pack(side="left", padx=(0, 15))
+        
+        # Connection status indicator
+        self.conn_status_label = ttk.Label(button_frame, text="●", foreground="red", font=('Segoe UI', 14, 'bold'))
+        self.conn_status_label.pack(side="left")
+        
+        # Subscribed topics display
+        topics_frame = ttk.LabelFrame(mqtt_frame, text="📡 Subscribed Topics", padding=10)
+        topics_frame.pack(fill="both", expand=True, padx=15, pady=(0, 15))
+        
+        # Create frame for listbox and scrollbar
+        list_frame = ttk.Frame(topics_frame)
+        list_frame.pack(fill="both", expand=True)
+        
+        self.topics_listbox = tk.Listbox(list_frame, height=8, font=('Consolas', 9))
+        topics_scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.topics_listbox.yview)
+        self.topics_listbox.configure(yscrollcommand=topics_scrollbar.set)
+        
+        self.topics_listbox.pack(side="left", fill="both", expand=True)
+        topics_scrollbar.pack(side="right", fill="y")
+        
+        conn_frame.columnconfigure(1, weight=1)
+        
+    def create_udp_mappings_tab(self, notebook):
+        udp_frame = ttk.Frame(notebook)
+        notebook.add(udp_frame, text="UDP Mappings")
+        
+        # Add new mapping frame
+        add_frame = ttk.LabelFrame(udp_frame, text="➕ Add New Mapping", padding=10)
+        add_frame.pack(fill="x", padx=15, pady=15)
+        
+        # Topic
+        ttk.Label(add_frame, text="MQTT Topic:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+        self.new_topic_entry = ttk.Entry(add_frame, width=25, font=('Segoe UI', 9))
+        self.new_topic_entry.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        
+        # Destinations
+        ttk.Label(add_frame, text="Destinations:").grid(row=0, column=2, padx=5, pady=5, sticky="w")
+        self.new_destinations_entry = ttk.Entry(add_frame, width=25, font=('Segoe UI', 9))
+        self.new_destinations_entry.insert(0, "127.0.0.1:8080")
+        self.new_destinations_entry.grid(row=0, column=3, padx=5, pady=5, sticky="ew")
+        
+        # UDP Message
+        ttk.Label(add_frame, text="UDP Message:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+        self.new_udp_message_entry = ttk.Entry(add_frame, width=25, font=('Segoe UI', 9))
+        self.new_udp_message_entry.insert(0, "{payload}")
+        self.new_udp_message_entry.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+        
+        # Trigger condition
+        ttk.Label(add_frame, text="Trigger on:").grid(row=1, column=2, padx=5, pady=5, sticky="w")
+        self.new_trigger_entry = ttk.Entry(add_frame, width=10, font=('Segoe UI', 9))
+        self.new_trigger_entry.insert(0, "1")
+        self.new_trigger_entry.grid(row=1, column=3, padx=5, pady=5, sticky="w")
+        
+        # UDP Send Delay
+        ttk.Label(add_frame, text="UDP Delay (sec):").grid(row=2, column=0, padx=5, pady=5, sticky="w")
+        self.new_delay_entry = ttk.Entry(add_frame, width=10, font=('Segoe UI', 9))
+        self.new_delay_entry.insert(0, "0.0")
+        self.new_delay_entry.grid(row=2, column=1, padx=5, pady=5, sticky="w")
+        
+        # Trigger mode
+        ttk.Label(add_frame, text="Trigger mode:").grid(row=2, column=2, padx=5, pady=5, sticky="w")
+        self.new_mode_var = tk.StringVar(value="level")
+        ttk.Combobox(add_frame, textvariable=self.new_mode_var, values=TRIGGER_MODES, state="readonly",
+                     width=10).grid(row=2, column=3, padx=5, pady=5, sticky="w")
+        
+        # Add button and help
+        button_help_frame = ttk.Frame(add_frame)
+        button_help_frame.grid(row=3, column=0, columnspan=4, pady=15, sticky="ew")
+        
+        ttk.Button(button_help_frame, text="➕ Add Mapping", command=self.add_mapping).pack(side="left")
+        
+        # Help text
+        help_text = "💡 Use {payload} for MQTT message content, {topic} for topic name. Destinations: host:port, comma separated. Trigger on: value to send UDP (leave empty for all). Trigger mode: level sends every match, rising/falling when the trigger starts/stops matching, change when the value changes. UDP Delay: seconds to wait before sending (0.1 precision)"
+        ttk.Label(button_help_frame, text=help_text, style='Info.TLabel').pack(side="left", padx=(20, 0))
+        
+        add_frame.columnconfigure(1, weight=1)
+        add_frame.columnconfigure(3, weight=1)
+        
+        # Current mappings frame
+        mappings_frame = ttk.LabelFrame(udp_frame, text="📋 Current Mappings", padding=10)
+        mappings_frame.pack(fill="both", expand=True, padx=15, pady=(0, 15))
+        
+        # Filter box and paging
+        filter_frame = ttk.Frame(mappings_frame)
+        filter_frame.pack(fill="x", pady=(0, 5))
+        ttk.Label(filter_frame, text="🔍 Filter:").pack(side="left")
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add('write', self.on_filter_changed)
+        ttk.Entry(filter_frame, textvariable=self.filter_var, width=40, font=('Segoe UI', 9)).pack(side="left", padx=5)
+        ttk.Button(filter_frame, text="Next ▶", command=lambda: self.show_page(self.page + 1)).pack(side="right")
+        ttk.Button(filter_frame, text="◀ Prev", command=lambda: self.show_page(self.page - 1)).pack(side="right", padx=5)
+        self.page_var = tk.StringVar()
+        ttk.Label(filter_frame, textvariable=self.page_var, style='Info.TLabel').pack(side="right", padx=10)
+        
+        # Only the current page of the (filtered) mappings is in the Treeview
+        self.visible_mappings = []
+        self.page = 0
+        self.row_mappings = {}  # Treeview item -> mapping
+        self.mapping_rows = {}  # id(mapping) -> Treeview item
+        self.filter_job = None
+        
+        # Create frame for treeview and scrollbar
+        tree_frame = ttk.Frame(mappings_frame)
+        tree_frame.pack(fill="both", expand=True, pady=(0, 10))
+        
+        # Treeview for mappings
+        columns = ("Topic", "Destinations", "UDP Message", "Trigger On", "Mode", "Delay (s)")
+        self.mappings_tree = ttk.Treeview(tree_frame, columns=columns, show="headings", height=10)
+        
+        for i, col in enumerate(columns):
+            self.mappings_tree.heading(col, text=col)
+            if col in ["Destinations", "UDP Message"]:
+                self.mappings_tree.column(col, width=160)
+            elif col in ["Trigger On", "Mode", "Delay (s)"]:
+                self.mappings_tree.column(col, width=80)
+            else:
+                self.mappings_tree.column(col, width=120)
+        
+        mappings_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.mappings_tree.yview)
+        self.mappings_tree.configure(yscrollcommand=mappings_scrollbar.set)
+        
+        self.mappings_tree.pack(side="left", fill="both", expand=True)
+        mappings_scrollbar.pack(side="right", fill="y")
+        
+        # Bind double-click to edit
+        self.mappings_tree.bind("<Double-1>", self.edit_mapping)
+        
+        # Buttons
+        button_frame = ttk.Frame(mappings_frame)
+        button_frame.pack()
+        ttk.Button(button_frame, text="✏️ Edit Selected", command=self.edit_mapping).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="🗑️ Remove Selected", command=self.remove_mapping).pack(side="left", padx=5)
+        
+    def create_messages_tab(self, notebook):
+        messages_frame = ttk.Frame(notebook)
+        notebook.add(messages_frame, text="Messages & Log")
+        
+        # Control buttons
+        control_frame = ttk.Frame(messages_frame)
+        control_frame.pack(fill="x", padx=15, pady=15)
+        
+        ttk.Button(control_frame, text="🧹 Clear Log", command=self.clear_messages).pack(side="left", padx=5)
+        ttk.Button(control_frame, text="🔄 Reload Mappings", command=self.reload_mappings).pack(side="left", padx=5)
+        ttk.Button(control_frame, text="🔬 Capture Profile", command=self.capture_profile).pack(side="left", padx=5)
+        
+        # Enable/disable UDP sending
+        self.udp_enabled_var = tk.BooleanVar(value=self.udp_sending_enabled)
+        ttk.Checkbutton(control_frame, text="🚀 Enable UDP Sending", variable=self.udp_enabled_var,
+                        command=self.on_udp_enabled_changed).pack(side="left", padx=20)
+        
+        # Mappings file info
+        mappings_info = ttk.Label(control_frame, text=f"📄 {self.mappings_file}", style='Info.TLabel')
+        mappings_info.pack(side="right", padx=5)
+        
+        # Sender statistics
+        self.stats_var = tk.StringVar()
+        ttk.Label(control_frame, textvariable=self.stats_var, style='Info.TLabel').pack(side="right", padx=5)
+        
+        # Messages display
+        self.message_display = scrolledtext.ScrolledText(messages_frame, wrap=tk.WORD, height=25, font=('Consolas', 9))
+        self.message_display.pack(fill="both", expand=True, padx=15, pady=(0, 15))
+        self.message_display.config(state=tk.DISABLED)
+        
+    def add_mapping(self):
+        topic = self.new_topic_entry.get().strip()
+        destinations_text = self.new_destinations_entry.get().strip()
+        udp_message = self.new_udp_message_entry.get().strip()
+        trigger_value = self.new_trigger_entry.get().strip()
+        delay_str = self.new_delay_entry.get().strip()
+        
+        # Validate delay value
+        try:
+            udp_delay = float(delay_str) if delay_str else 0.0
+            # Round to nearest 0.1 second
+            udp_delay = round(udp_delay, 1)
+            if udp_delay < 0:
+                udp_delay = 0.0
+        except ValueError:
+            messagebox.showerror("Error", "UDP Delay must be a number (seconds)")
+            return
+        
+        if not topic or not destinations_text or not udp_message:
+            messagebox.showerror("Error", "Topic, Destinations, and UDP Message are required")
+            return
+        
+        try:
+            destinations = parse_destinations(destinations_text)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        # Check if topic already exists
+        if topic in self.mappings_by_topic:
+            messagebox.showerror("Error", f"Topic '{topic}' already has a mapping")
+            return
+        
+        mapping = {
+            'topic': topic,
+            'udp_message': udp_message,
+            'trigger_value': trigger_value,  # Empty string means trigger on any value
+            'trigger_mode': self.new_mode_var.get(),
+            'udp_delay': udp_delay  # Delay in seconds before sending UDP
+        }
+        set_destinations(mapping, destinations)
+        
+        self.insert_mapping(mapping)
+        self.save_broker_settings()
+        self.request_save()
+        self.display_added_mapping(mapping)
+        self.update_mqtt_subscriptions()
+        
+        # Clear entries
+        self.new_topic_entry.delete(0, tk.END)
+        self.new_destinations_entry.delete(0, tk.END)
+        self.new_destinations_entry.insert(0, "127.0.0.1:8080")
+        self.new_udp_message_entry.delete(0, tk.END)
+        self.new_udp_message_entry.insert(0, "{payload}")
+        self.new_trigger_entry.delete(0, tk.END)
+        self.new_trigger_entry.insert(0, "1")
+        self.new_mode_var.set("level")
+        self.new_delay_entry.delete(0, tk.END)
+        self.new_delay_entry.insert(0, "0.0")
+        
+    def remove_mapping(self):
+        selection = self.mappings_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select a mapping to remove")
+            return
+        
+        mappings = [self.row_mappings[item] for item in selection]
+        self.delete_mappings(mappings)
+        self.request_save()
+        for mapping in mappings:
+            self.display_removed_mapping(mapping)
+        self.update_mqtt_subscriptions()
+        
+    def edit_mapping(self, event=None):
+        """Edit selected mapping"""
+        selection = self.mappings_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select a mapping to edit")
+            return
+        
+        mapping_to_edit = self.row_mappings.get(selection[0])
+        if not mapping_to_edit:
+            messagebox.showerror("Error", "Could not find mapping to edit")
+            return
+        
+        # Create edit dialog
+        self.show_edit_dialog(mapping_to_edit)
+    
+    def show_edit_dialog(self, mapping):
+        """Show dialog to edit a mapping"""
+        edit_window = tk.Toplevel(self.root)
+        edit_window.title("Edit Mapping")
+        edit_window.geometry("800x550")
+        edit_window.transient(self.root)
+        edit_window.grab_set()
+        
+        # Center the window
+        edit_window.geometry("+%d+%d" % (self.root.winfo_rootx() + 150, self.root.winfo_rooty() + 100))
+        
+        # Create form
+        form_frame = ttk.LabelFrame(edit_window, text="Edit Mapping", padding=20)
+        form_frame.pack(fill="both", expand=True, padx=20, pady=20)
+        
+        # Topic
+        ttk.Label(form_frame, text="MQTT Topic:").grid(row=0, column=0, padx=10, pady=10, sticky="w")
+        topic_entry = ttk.Entry(form_frame, width=100, font=('Segoe UI', 9))
+        topic_entry.insert(0, mapping['topic'])
+        topic_entry.grid(row=0, column=1, padx=10, pady=10, sticky="ew")
+        
+        # Destinations
+        ttk.Label(form_frame, text="Destinations:").grid(row=1, column=0, padx=10, pady=10, sticky="w")
+        destinations_entry = ttk.Entry(form_frame, width=100, font=('Segoe UI', 9))
+        destinations_entry.insert(0, format_destinations(mapping_destinations(mapping)))
+        destinations_entry.grid(row=1, column=1, padx=10, pady=10, sticky="ew")
+        
+        # UDP Message
+        ttk.Label(form_frame, text="UDP Message:").grid(row=2, column=0, padx=10, pady=10, sticky="w")
+        message_entry = ttk.Entry(form_frame, width=100, font=('Segoe UI', 9))
+        message_entry.insert(0, mapping['udp_message'])
+        message_entry.grid(row=2, column=1, padx=10, pady=10, sticky="ew")
+        
+        # Trigger Value
+        ttk.Label(form_frame, text="Trigger on:").grid(row=3, column=0, padx=10, pady=10, sticky="w")
+        trigger_entry = ttk.Entry(form_frame, width=20, font=('Segoe UI', 9))
+        trigger_entry.insert(0, mapping.get('trigger_value', ''))
+        trigger_entry.grid(row=3, column=1, padx=10, pady=10, sticky="ew")
+        
+        # Trigger Mode
+        ttk.Label(form_frame, text="Trigger mode:").grid(row=4, column=0, padx=10, pady=10, sticky="w")
+        mode_frame = ttk.Frame(form_frame)
+        mode_frame.grid(row=4, column=1, padx=10, pady=10, sticky="w")
+        mode_var = tk.StringVar(value=mapping.get('trigger_mode', 'level'))
+        ttk.Combobox(mode_frame, textvariable=mode_var, values=TRIGGER_MODES, state="readonly",
+                     width=18).pack(side="left")
+        ttk.Label(mode_frame, text="MQTT QoS:").pack(side="left", padx=(15, 5))
+        qos_var = tk.StringVar(value=str(mapping.get('qos', 0)))
+        ttk.Combobox(mode_frame, textvariable=qos_var, values=("0", "1", "2"), state="readonly",
+                     width=4).pack(side="left")
+        
+        # Rate Limit
+        ttk.Label(form_frame, text="Rate limit (msg/s):").grid(row=5, column=0, padx=10, pady=10, sticky="w")
+        rate_frame = ttk.Frame(form_frame)
+        rate_frame.grid(row=5, column=1, padx=10, pady=10, sticky="w")
+        rate_entry = ttk.Entry(rate_frame, width=10, font=('Segoe UI', 9))
+        rate_entry.insert(0, str(mapping.get('rate_limit', 0)))
+        rate_entry.pack(side="left")
+        ttk.Label(rate_frame, text="When limited:").pack(side="left", padx=(15, 5))
+        rate_overflow_var = tk.StringVar(value=mapping.get('rate_overflow', 'drop'))
+        ttk.Combobox(rate_frame, textvariable=rate_overflow_var, values=RATE_OVERFLOW_POLICIES, state="readonly",
+                     width=10).pack(side="left")
+        
+        # Retries
+        ttk.Label(form_frame, text="Retries on error:").grid(row=6, column=0, padx=10, pady=10, sticky="w")
+        retry_frame = ttk.Frame(form_frame)
+        retry_frame.grid(row=6, column=1, padx=10, pady=10, sticky="w")
+        retry_entry = ttk.Entry(retry_frame, width=10, font=('Segoe UI', 9))
+        retry_entry.insert(0, str(mapping.get('retry_attempts', 0)))
+        retry_entry.pack(side="left")
+        ttk.Label(retry_frame, text="First backoff (sec):").pack(side="left", padx=(15, 5))
+        backoff_entry = ttk.Entry(retry_frame, width=10, font=('Segoe UI', 9))
+        backoff_entry.insert(0, str(mapping.get('retry_backoff', 0.1)))
+        backoff_entry.pack(side="left")
+        
+        # UDP Delay
+        ttk.Label(form_frame, text="UDP Delay (sec):").grid(row=7, column=0, padx=10, pady=10, sticky="w")
+        delay_entry = ttk.Entry(form_frame, width=20, font=('Segoe UI', 9))
+        delay_entry.insert(0, str(mapping.get('udp_delay', 0.0)))
+        delay_entry.grid(row=7, column=1, padx=10, pady=10, sticky="ew")
+        
+        # Help text
+        help_text = "💡 Use {payload} for MQTT message content, {topic} for topic name. Destinations: host:port, comma separated. Trigger on: value to send UDP (leave empty for all). Trigger mode: level sends every match, rising/falling when the trigger starts/stops matching, change when the value changes. MQTT QoS: subscription QoS for the topic. Rate limit: 0 for none; drop or coalesce (send only the latest) messages over the limit. Retries: 0 for none; failed sends are retried with a doubling backoff. UDP Delay: seconds to wait before sending (0.1 precision)"
+        ttk.Label(form_frame, text=help_text, font=("Segoe UI", 8)).grid(row=8, column=0, columnspan=2, padx=10, pady=5)
+        
+        # Buttons
+        button_frame = ttk.Frame(form_frame)
+        button_frame.grid(row=9, column=0, columnspan=2, pady=20)
+        
+        def save_changes():
+            new_topic = topic_entry.get().strip()
+            new_destinations_text = destinations_entry.get().strip()
+            new_message = message_entry.get().strip()
+            new_trigger = trigger_entry.get().strip()
+            new_delay_str = delay_entry.get().strip()
+            
+            try:
+                new_rate = float(rate_entry.get().strip() or 0)
+            except ValueError:
+                messagebox.showerror("Error", "Rate limit must be a number (messages per second)")
+                return
+            
+            try:
+                new_retries = max(0, int(retry_entry.get().strip() or 0))
+                new_backoff = max(0.0, float(backoff_entry.get().strip() or 0.1))
+            except ValueError:
+                messagebox.showerror("Error", "Retries must be a whole number and the backoff a number (seconds)")
+                return
+            
+            # Validate delay value
+            try:
+                new_delay = float(new_delay_str) if new_delay_str else 0.0
+                # Round to nearest 0.1 second
+                new_delay = round(new_delay, 1)
+                if new_delay < 0:
+                    new_delay = 0.0
+            except ValueError:
+                messagebox.showerror("Error", "UDP Delay must be a number (seconds)")
+                return
+            
+            if not new_topic or not new_destinations_text or not new_message:
+                messagebox.showerror("Error", "Topic, Destinations, and UDP Message are required")
+                return
+            
+            try:
+                new_destinations = parse_destinations(new_destinations_text)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            
+            # Check if new topic conflicts with existing mappings (except current one)
+            existing_mapping = self.mappings_by_topic.get(new_topic)
+            if existing_mapping is not None and existing_mapping is not mapping:
+                messagebox.showerror("Error", f"Topic '{new_topic}' already has a mapping")
+                return
+            
+            # Re-index just this mapping; delayed sends queued with the old settings are dropped
+            self.unindex_mapping(mapping)
+            
+            # Update the mapping
+            mapping['topic'] = new_topic
+            set_destinations(mapping, new_destinations)
+            mapping['udp_message'] = new_message
+            mapping['trigger_value'] = new_trigger
+            mapping['trigger_mode'] = mode_var.get()
+            if int(qos_var.get()):
+                mapping['qos'] = int(qos_var.get())
+            else:
+                mapping.pop('qos', None)
+            if new_rate > 0:
+                mapping['rate_limit'] = new_rate
+                mapping['rate_overflow'] = rate_overflow_var.get()
+            else:
+                for key in ('rate_limit', 'rate_burst', 'rate_overflow'):
+                    mapping.pop(key, None)
+            if new_retries:
+                mapping['retry_attempts'] = new_retries
+                mapping['retry_backoff'] = new_backoff
+            else:
+                for key in ('retry_attempts', 'retry_backoff'):
+                    mapping.pop(key, None)
+            mapping['udp_delay'] = new_delay
+            
+            self.index_mapping(mapping)
+            self.request_save()
+            self.display_updated_mapping(mapping)
+            self.update_mqtt_subscriptions()
+            
+            edit_window.destroy()
+            self.log_message(f"✏️ Updated mapping: {new_topic}")
+        
+        def cancel_edit():
+            edit_window.destroy()
+        
+        ttk.Button(button_frame, text="💾 Save Changes", command=save_changes).pack(side="left", padx=10)
+        ttk.Button(button_frame, text="❌ Cancel", command=cancel_edit).pack(side="left", padx=10)
+        
+        form_frame.columnconfigure(1, weight=1)
+        
+        # Focus on first field
+        topic_entry.focus_set()
+        
+    def mapping_row(self, mapping):
+        """Treeview values for a mapping"""
+        trigger_display = mapping.get('trigger_value', '')
+        if trigger_display == '':
+            trigger_display = 'any'
+        delay_display = mapping.get('udp_delay', 0.0)
+        return (
+            mapping['topic'],
+            format_destinations(mapping_destinations(mapping)),
+            mapping['udp_message'],
+            trigger_display,
+            mapping.get('trigger_mode', 'level'),
+            f"{delay_display:.1f}"
+        )
+    
+    def filter_matches(self, mapping, text):
+        """Case-insensitive match of the filter text against topic, destinations and message"""
+        return (text in mapping['topic'].lower()
+                or text in mapping['udp_message'].lower()
+                or text in format_destinations(mapping_destinations(mapping)).lower())
+    
+    def update_mappings_display(self):
+        """Re-apply the filter and redraw the current page"""
+        text = self.filter_var.get().strip().lower()
+        if text:
+            self.visible_mappings = [m for m in self.udp_mappings if self.filter_matches(m, text)]
+        else:
+            self.visible_mappings = list(self.udp_mappings)
+        self.show_page(self.page)
+    
+    def show_page(self, page):
+        """Fill the Treeview with one page of the visible mappings"""
+        pages = max(1, -(-len(self.visible_mappings) // MAPPINGS_PAGE_SIZE))
+        self.page = min(max(0, page), pages - 1)
+        
+        self.mappings_tree.delete(*self.mappings_tree.get_children())
+        self.row_mappings.clear()
+        self.mapping_rows.clear()
+        start = self.page * MAPPINGS_PAGE_SIZE
+        for mapping in self.visible_mappings[start:start + MAPPINGS_PAGE_SIZE]:
+            self.insert_mapping_row(mapping)
+        self.update_page_label()
+    
+    def insert_mapping_row(self, mapping):
+        item = self.mappings_tree.insert("", "end", values=self.mapping_row(mapping))
+        self.row_mappings[item] = mapping
+        self.mapping_rows[id(mapping)] = item
+    
+    def update_page_label(self):
+        total = len(self.visible_mappings)
+        start = self.page * MAPPINGS_PAGE_SIZE
+        text = f"{min(start + 1, total)}–{min(start + MAPPINGS_PAGE_SIZE, total)} of {total}"
+        if total != len(self.udp_mappings):
+            text += f" (filtered from {len(self.udp_mappings)})"
+        self.page_var.set(text)
+    
+    def on_filter_changed(self, *args):
+        """Re-filter once typing pauses"""
+        if self.filter_job is not None:
+            self.root.after_cancel(self.filter_job)
+        self.filter_job = self.root.after(FILTER_DELAY_MS, self.apply_filter)
+    
+    def apply_filter(self):
+        self.filter_job = None
+        self.page = 0
+        self.update_mappings_display()
+    
+    def display_added_mapping(self, mapping):
+        """Show a new mapping without redrawing the table"""
+        text = self.filter_var.get().strip().lower()
+        if text and not self.filter_matches(mapping, text):
+            return
+        self.visible_mappings.append(mapping)
+        # Only the last page has room for it
+        if len(self.visible_mappings) <= (self.page + 1) * MAPPINGS_PAGE_SIZE:
+            self.insert_mapping_row(mapping)
+            self.mappings_tree.see(self.mapping_rows[id(mapping)])
+        self.update_page_label()
+    
+    def display_updated_mapping(self, mapping):
+        """Refresh the row of an edited mapping"""
+        item = self.mapping_rows.get(id(mapping))
+        if item is not None:
+            self.mappings_tree.item(item, values=self.mapping_row(mapping))
+    
+    def display_removed_mapping(self, mapping):
+        """Drop the row of a removed mapping"""
+        item = self.mapping_rows.pop(id(mapping), None)
+        if item is not None:
+            self.mappings_tree.delete(item)
+            del self.row_mappings[item]
+        self.visible_mappings = [m for m in self.visible_mappings if m is not mapping]
+        self.update_page_label()
+    
+    def update_mqtt_subscriptions(self):
+        super().update_mqtt_subscriptions()
+        
+        # Update topics listbox
+        self.topics_listbox.delete(0, tk.END)
+        self.topics_listbox.insert(tk.END, *(mapping['topic'] for mapping in self.udp_mappings))
+        
+    def toggle_connection(self):
+        if not self.connected:
+            self.connect_mqtt()
+        else:
+            self.disconnect_mqtt()
+    
+    def connect_mqtt(self):
+        broker = self.broker_entry.get().strip()
+        try:
+            port = int(self.port_entry.get().strip())
+        except ValueError:
+            self.log_message("Error: Port must be a number")
+            return
+        
+        # Save broker settings
+        self.save_broker_settings()
+        
+        # Update status
+        self.status_var.set(f"Connecting to {broker}:{port}...")
+        self.root.update()
+        
+        if super().connect_mqtt():
+            self.connect_button.config(text="🔌 Disconnect")
+    
+    def auto_connect(self):
+        """Automatically connect on startup if enabled"""
+        if self.broker_settings.get('auto_connect', True) and not self.connected:
+            self.log_message("🔄 Auto-connecting to broker...")
+            # Add small delay before attempting connection to prevent timeout
+            self.root.after(500, self.connect_mqtt)
+    
+    def save_auto_connect_setting(self):
+        """Save the auto-connect setting"""
+        self.broker_settings['auto_connect'] = self.auto_connect_var.get()
+        self.request_save()
+    
+    def disconnect_mqtt(self):
+        super().disconnect_mqtt()
+        self.connect_button.config(text="🔌 Connect")
+    
+    def set_status(self, text, color=None):
+        """Show connection status in the status bar"""
+        self.status_var.set(text)
+        if color:
+            self.conn_status_label.config(foreground=color)
+        self.connect_button.config(text="🔌 Disconnect" if self.connected else "🔌 Connect")
+    
+    def flush_log(self):
+        """Write queued log lines to the Messages tab in one batch"""
+        lines = self.log_pipeline.drain()
+        if lines:
+            self.message_display.config(state=tk.NORMAL)
+            self.message_display.insert(tk.END, "\n".join(lines) + "\n")
+            
+            # Keep only the last LOG_MAX_LINES lines
+            line_count = int(self.message_display.index('end-1c').split('.')[0]) - 1
+            if line_count > LOG_MAX_LINES:
+                self.message_display.delete('1.0', f"{line_count - LOG_MAX_LINES + 1}.0")
+            
+            self.message_display.see(tk.END)
+            self.message_display.config(state=tk.DISABLED)
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_log)
+    
+    def watch_config(self):
+        """Run poll_config() on the Tk thread, which owns the mappings"""
+        self.poll_config()
+        self.root.after(CONFIG_POLL_INTERVAL_MS, self.watch_config)
+    
+    def on_udp_enabled_changed(self):
+        self.set_udp_enabled(self.udp_enabled_var.get())
+    
+    def update_stats_display(self):
+        """Show sender statistics in the Messages tab"""
+        stats = self.stats()
+        sender, queue, delayed = stats['sender'], stats['queue'], stats['delayed']
+        self.stats_var.set(f"⏱️ Delayed: {delayed['pending']} pending, late avg {delayed['avg_lateness'] * 1000:.1f} ms / max {delayed['max_lateness'] * 1000:.1f} ms  "
+                           f"📥 Queue: {queue['depth']}/{queue['queue_size']} (dropped {queue['dropped']})  "
+                           f"🔌 Sockets: {sender['sockets_created']} created / {sender['sends']} sends / {sender['errors']} errors"
+                           + (f"  📤 Ingress: {stats['ingress']['ports']} ports / {stats['ingress']['received']} datagrams" if stats['ingress']['ports'] else ""))
+        
+        # Per-second rates and latency for the status bar
+        totals, histograms = self.metrics.totals()
+        previous = self.last_totals or totals
+        self.last_totals = totals
+        summary = (f"📈 {totals['messages_received'] - previous['messages_received']}/s in · "
+                   f"{totals['sends'] - previous['sends']}/s out · {totals['send_errors']} errors")
+        if totals['rate_limited'] or totals['coalesced']:
+            summary += f" · 🚦 {totals['rate_limited']} rate-limited / {totals['coalesced']} coalesced"
+        if totals['retries'] or totals['circuit_open']:
+            summary += f" · 🔂 {totals['retries']} retries / {totals['circuit_open']} skipped by open circuits"
+        latency = histograms.get('send_latency_seconds')
+        if latency and latency.count:
+            summary += f" · p50 ≤ {latency.quantile(0.5) * 1000:.2f} ms · p99 ≤ {latency.quantile(0.99) * 1000:.2f} ms"
+        self.metrics_var.set(summary)
+        
+        self.root.after(1000, self.update_stats_display)
+    
+    def clear_messages(self):
+        self.message_display.config(state=tk.NORMAL)
+        self.message_display.delete(1.0, tk.END)
+        self.message_display.config(state=tk.DISABLED)
+    
+    def save_broker_settings(self):
+        """Save current broker settings from the UI"""
+        try:
+            self.broker_settings['address'] = self.broker_entry.get().strip()
+            self.broker_settings['protocol'] = self.protocol_var.get()
+            self.broker_settings['share_group'] = self.share_group_entry.get().strip()
+            self.broker_settings['port'] = int(self.port_entry.get().strip())
+        except ValueError:
+            # If port is invalid, keep the old value
+            pass
+    
+    def reload_mappings(self):
+        """Reload mappings and broker settings from file and update displays"""
+        result = super().reload_mappings()
+        if result is None:
+            return result  # File could not be used, nothing changed
+        
+        # Update UI with loaded broker settings
+        self.broker_entry.delete(0, tk.END)
+        self.broker_entry.insert(0, self.broker_settings['address'])
+        self.port_entry.delete(0, tk.END)
+        self.port_entry.insert(0, str(self.broker_settings['port']))
+        self.auto_connect_var.set(self.broker_settings.get('auto_connect', True))
+        self.protocol_var.set(str(self.broker_settings.get('protocol', '3.1.1')))
+        self.share_group_entry.delete(0, tk.END)
+        self.share_group_entry.insert(0, self.broker_settings.get('share_group', ''))
+        
+        self.update_mappings_display()
+        return result
+        
+    def on_closing(self):
+        self.shutdown()
+        # Save mappings one final time before closing
+        self.save_mappings()
+        self.root.destroy()
+
+
+def run_gui(mappings_file=DEFAULT_MAPPINGS_FILE, record_file=None):
+    root = tk.Tk()
+    app = MQTTUDPBridge(root, mappings_file)
+    if record_file:
+        app.start_recording(record_file)
+    root.protocol("WM_DELETE_WINDOW", app.on_closing)
+    root.mainloop()
@@ -0,0 +1,229 @@
+"""UDP to MQTT ingress: listen on UDP ports and publish matching datagrams to MQTT"""
+import re
+import selectors
+import socket
+import string
+import threading
+
+# Placeholders every ingress template may use, besides the named groups of its pattern
+INGRESS_FIELDS = ('payload', 'source', 'source_port')
+
+# Datagrams read from one socket per loop pass, so a busy port cannot starve the others
+MAX_DATAGRAMS_PER_READ = 64
+
+MAX_DATAGRAM_SIZE = 65535
+
+
+def _template_fields(template):
+    return [field for _, field, _, _ in string.Formatter().parse(template) if field is not None]
+
+
+def compile_udp_pattern(pattern):
+    """Regex for a 'STATUS {device} {value}' style pattern, each {name} matching lazily"""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(pattern):
+        parts.append(re.escape(literal))
+        if field is not None:
+            parts.append(f"(?P<{field}>.+?)" if field else "(?:.+?)")
+    return re.compile(''.join(parts), re.DOTALL)
+
+
+class IngressRoute:
+    """One ingress mapping compiled: which datagrams it accepts and what it publishes.
+
+    A datagram is accepted when udp_regex (searched) or udp_pattern (whole
+    datagram) matches; with neither every datagram is accepted. mqtt_topic
+    and mqtt_payload are format strings over the pattern's named groups
+    and INGRESS_FIELDS. Raises ValueError for an invalid entry.
+    """
+
+    __slots__ = ('mapping', 'address', 'label', 'regex', 'full_match', 'topic', 'payload', 'qos', 'retain')
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        try:
+            self.address = (mapping.get('listen_ip', '0.0.0.0'), int(mapping['listen_port']))
+            self.topic = mapping['mqtt_topic']
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("ingress mappings need listen_port and mqtt_topic")
+        self.label = f"udp:{self.address[1]}"
+        self.payload = mapping.get('mqtt_payload', '{payload}')
+        self.qos = int(mapping.get('qos', 0))
+        self.retain = bool(mapping.get('retain', False))
+        if self.qos not in (0, 1, 2):
+            raise ValueError(f"qos must be 0, 1 or 2, got {self.qos}")
+
+        try:
+            if mapping.get('udp_regex'):
+                self.regex = re.compile(mapping['udp_regex'])
+                self.full_match = False
+            elif mapping.get('udp_pattern'):
+                self.regex = compile_udp_pattern(mapping['udp_pattern'])
+                self.full_match = True
+            else:
+                self.regex = None
+                self.full_match = False
+        except re.error as e:
+            raise ValueError(f"invalid pattern: {e}")
+
+        available = set(INGRESS_FIELDS) | set(self.regex.groupindex if self.regex else ())
+        for template in (self.topic, self.payload):
+            unknown = [field for field in _template_fields(template) if field not in available]
+            if unknown:
+                raise ValueError(f"unknown placeholder {{{unknown[0]}}} in '{template}'")
+
+    def parse(self, text, source):
+        """(topic, payload) to publish for a datagram, or None if it does not match"""
+        fields = {'payload': text, 'source': source[0], 'source_port': source[1]}
+        if self.regex is not None:
+            match = self.regex.fullmatch(text) if self.full_match else self.regex.search(text)
+            if match is None:
+                return None
+            fields.update((name, value or '') for name, value in match.groupdict().items())
+        return self.topic.format_map(fields), self.payload.format_map(fields)
+
+
+class UDPIngress:
+    """Listens on any number of UDP ports from one selectors loop thread.
+
+    configure() binds and closes sockets on the caller's thread, so bind
+    errors are reported straight away, and hands them to the loop. The
+    loop reads every ready socket, parses the datagrams with the routes
+    bound to that address and passes everything read in one pass to
+    on_batch([(route, topic, payload, source)]), from the loop thread.
+    Datagrams no route accepts go to on_unmatched(address_label, count).
+    """
+
+    def __init__(self, on_batch, on_unmatched=None, log=print):
+        self.on_batch = on_batch
+        self.on_unmatched = on_unmatched
+        self.log = log
+        self._sockets = {}  # (ip, port) -> bound socket
+        self._routes = {}   # (ip, port) -> [IngressRoute], replaced as a whole
+        self._changes = []  # ([(address, socket)] to register, [(address, socket)] to close) for the loop
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self.received = 0
+
+    def configure(self, routes):
+        """Listen for exactly the addresses used by routes"""
+        wanted = {}
+        for route in routes:
+            wanted.setdefault(route.address, []).append(route)
+
+        added = []
+        for address in wanted:
+            if address in self._sockets:
+                continue
+            family = socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(address)
+                sock.setblocking(False)
+            except OSError as e:
+                sock.close()
+                self.log(f"❌ Cannot listen on UDP {address[0]}:{address[1]}: {str(e)}")
+                continue
+            self._sockets[address] = sock
+            added.append((address, sock))
+            self.log(f"👂 Listening for UDP on {address[0]}:{address[1]}")
+        removed = [(address, self._sockets.pop(address)) for address in list(self._sockets) if address not in wanted]
+
+        self._routes = wanted
+        if not added and not removed:
+            return
+        with self._lock:
+            self._changes.append((added, removed))
+        if self._thread is None and self._sockets:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='udp-ingress', daemon=True)
+            self._thread.start()
+        self._wake()
+
+    def addresses(self):
+        return list(self._sockets)
+
+    def stop(self):
+        self._running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(1.0)
+        for sock in self._sockets.values():
+            sock.close()
+        self._sockets.clear()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _apply_changes(self, selector):
+        with self._lock:
+            changes, self._changes = self._changes, []
+        for added, removed in changes:
+            for _, sock in removed:
+                try:
+                    selector.unregister(sock)
+                except (KeyError, ValueError):
+                    pass
+                sock.close()
+            for address, sock in added:
+                selector.register(sock, selectors.EVENT_READ, address)
+
+    def _run(self):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._wake_r, selectors.EVENT_READ, None)
+            while self._running:
+                batch = []
+                unmatched = {}
+                for key, _ in selector.select():
+                    if key.data is None:
+                        try:
+                            while self._wake_r.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        self._apply_changes(selector)
+                        continue
+                    self._read(key.fileobj, key.data, batch, unmatched)
+                if batch:
+                    try:
+                        self.on_batch(batch)
+                    except Exception as e:
+                        self.log(f"❌ UDP ingress publish error: {str(e)}")
+                if unmatched and self.on_unmatched:
+                    for label, count in unmatched.items():
+                        self.on_unmatched(label, count)
+
+    def _read(self, sock, address, batch, unmatched):
+        routes = self._routes.get(address, ())
+        for _ in range(MAX_DATAGRAMS_PER_READ):
+            try:
+                data, source = sock.recvfrom(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # Closed by configure() between select() and here, or an ICMP error
+                return
+            self.received += 1
+            text = data.decode('utf-8', 'replace')
+            matched = False
+            for route in routes:
+                try:
+                    parsed = route.parse(text, source)
+                except (KeyError, IndexError, ValueError) as e:
+                    self.log(f"❌ UDP ingress template error for {route.label}: {str(e)}")
+                    continue
+                if parsed is not None:
+                    matched = True
+                    batch.append((route, parsed[0], parsed[1], source))
+            if not matched:
+                label = f"udp:{address[1]}"
+                unmatched[label] = unmatched.get(label, 0) + 1
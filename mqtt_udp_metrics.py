@@ -0,0 +1,227 @@
+"""Counters, latency histograms and a Prometheus endpoint for the bridge"""
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_METRICS_SETTINGS = {'enabled': True, 'address': '127.0.0.1', 'port': 9108}
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# name -> help text; counters are labelled by mapping topic unless noted
+COUNTERS = {
+    'messages_received': "MQTT messages received (not labelled by mapping)",
+    'matches': "Messages whose topic matched the mapping",
+    'triggers': "Matches whose payload passed the trigger",
+    'suppressed': "Matches not sent: trigger not met or UDP sending disabled",
+    'sends': "UDP datagrams sent",
+    'send_errors': "UDP sends that failed",
+    'rate_limited': "Sends dropped by a mapping or destination rate limit",
+    'coalesced': "Rate-limited sends replaced by a newer message before they went out",
+    'retries': "Retry attempts of failed sends",
+    'retry_dropped': "Failed sends not retried: out of attempts or retry queue full",
+    'circuit_open': "Sends skipped because the destination's circuit breaker was open",
+    'ingress_published': "UDP datagrams published to MQTT (labelled udp:<port>)",
+    'ingress_unmatched': "UDP datagrams no ingress mapping accepted (labelled udp:<port>)",
+    'ingress_dropped': "Ingress publishes dropped: not connected or publish failed (labelled udp:<port>)",
+}
+
+# name -> (help text, label name)
+HISTOGRAMS = {
+    'send_latency_seconds': ("MQTT callback entry to UDP sendto return, minus the configured udp_delay", 'path'),
+    'stage_seconds': ("Time spent per stage of the message path, for sampled messages", 'stage'),
+}
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def merge(self, other):
+        for i, value in enumerate(other.counts):
+            self.counts[i] += value
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None if empty)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, value in enumerate(self.counts):
+            seen += value
+            if seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float('inf')
+        return float('inf')
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = {}    # (name, label) -> int
+        self.histograms = {}  # (name, label) -> _Histogram
+
+
+class Metrics:
+    """Counters and histograms accumulated per thread and merged on read.
+
+    Every thread writes to its own shard without taking a lock, so leaving
+    the metrics on costs a few dict operations per message. Readers copy
+    the shards and sum them.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def inc(self, name, label=None, amount=1):
+        counters = self._shard().counters
+        key = (name, label)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, value, label=None):
+        histograms = self._shard().histograms
+        key = (name, label)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = _Histogram()
+        histogram.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+    def snapshot(self):
+        """Merged ({(name, label): count}, {(name, label): _Histogram})"""
+        with self._lock:
+            shards = list(self._shards)
+        counters = {}
+        histograms = {}
+        for shard in shards:
+            # dict.copy() is atomic, so the owning thread can keep writing
+            for key, value in shard.counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, histogram in shard.histograms.copy().items():
+                merged = histograms.get(key)
+                if merged is None:
+                    merged = histograms[key] = _Histogram()
+                merged.merge(histogram)
+        return counters, histograms
+
+    def load_snapshots(self, snapshots):
+        """Replace the contents with snapshot() results taken in other processes"""
+        shards = []
+        for counters, histograms in snapshots:
+            shard = _Shard()
+            shard.counters = dict(counters)
+            shard.histograms = dict(histograms)
+            shards.append(shard)
+        with self._lock:
+            self._shards = shards
+
+    def totals(self):
+        """Counters summed over all labels, plus the merged histograms by name"""
+        counters, histograms = self.snapshot()
+        totals = dict.fromkeys(COUNTERS, 0)
+        for (name, _), value in counters.items():
+            totals[name] = totals.get(name, 0) + value
+        merged = {}
+        for (name, _), histogram in histograms.items():
+            merged.setdefault(name, _Histogram()).merge(histogram)
+        return totals, merged
+
+    def render_prometheus(self, gauges=None, prefix='mqtt_udp'):
+        """Metrics in the Prometheus text exposition format"""
+        counters, histograms = self.snapshot()
+        lines = []
+
+        for name, help_text in COUNTERS.items():
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            values = sorted((label or '', value) for (n, label), value in counters.items() if n == name)
+            if not values:
+                lines.append(f"{metric} 0")
+            for label, value in values:
+                lines.append(f"{metric}{_labels(topic=label)} {value}")
+
+        for name, (help_text, label_name) in HISTOGRAMS.items():
+            metric = f"{prefix}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for (n, label), histogram in sorted(histograms.items(), key=lambda item: str(item[0][1])):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, value in zip(LATENCY_BUCKETS + (float('inf'),), histogram.counts):
+                    cumulative += value
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{metric}_bucket{_labels(**{label_name: label, 'le': le})} {cumulative}")
+                lines.append(f"{metric}_sum{_labels(**{label_name: label})} {histogram.sum}")
+                lines.append(f"{metric}_count{_labels(**{label_name: label})} {histogram.count}")
+
+        for name, (help_text, value) in (gauges or {}).items():
+            metric = f"{prefix}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels):
+    pairs = []
+    for key, value in labels.items():
+        if value:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class MetricsServer:
+    """Serves render() as text/plain on http://address:port/metrics in a background thread"""
+
+    def __init__(self, render, address='127.0.0.1', port=9108):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep scrapes out of the bridge log
+
+        self.httpd = ThreadingHTTPServer((address, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-http', daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        address, port = self.httpd.server_address[:2]
+        return f"http://{address}:{port}/metrics"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
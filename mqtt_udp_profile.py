@@ -0,0 +1,99 @@
+"""Opt-in timing of the message path stages, and a stack sampler for profiles"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# 'profiling' section of the mappings file. sample_rate is the share of
+# messages whose stages are timed (0 turns it off, 0.01 times every 100th);
+# captures sample every thread's stack each capture_interval seconds
+DEFAULT_PROFILING_SETTINGS = {'sample_rate': 0.0, 'capture_seconds': 10.0, 'capture_interval': 0.005}
+
+# Timed stages, in message order
+STAGES = ('log', 'match', 'trigger', 'dispatch', 'queue', 'render', 'sendto', 'send_log')
+
+
+class SpanSampler:
+    """Picks the messages whose stages are timed: every Nth for a rate of 1/N.
+
+    Callers test `every` before calling tick(), so with sampling off the
+    message path pays for one attribute check.
+    """
+
+    __slots__ = ('every', '_count')
+
+    def __init__(self, rate=0.0):
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        rate = min(float(rate), 1.0)
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._count = 0
+
+    def tick(self):
+        """True for the message to time (races between threads only shift the pick)"""
+        self._count += 1
+        if self._count >= self.every:
+            self._count = 0
+            return True
+        return False
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileCapture:
+    """Samples the stacks of all threads for a while on a thread of its own.
+
+    The result is written as folded stacks ('thread;outer;...;inner count'
+    per line), which flamegraph.pl, speedscope and inferno read directly.
+    on_done(path, samples, error) is called from the capture thread.
+    """
+
+    def __init__(self, path, seconds=10.0, interval=0.005, on_done=None):
+        self.path = path
+        self.seconds = seconds
+        self.interval = interval
+        self.on_done = on_done
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-capture', daemon=True)
+        self._thread.start()
+
+    def running(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        """End the capture early; the profile is still written"""
+        self._stop.set()
+        self._thread.join(2.0)
+
+    def _run(self):
+        stacks = Counter()
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+        error = None
+        try:
+            with open(self.path, 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            error = e
+        if self.on_done:
+            self.on_done(self.path, self.samples, error)
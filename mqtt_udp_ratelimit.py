@@ -0,0 +1,60 @@
+"""Token-bucket rate limits for UDP sends, per mapping and per destination"""
+import threading
+import time
+
+# What happens to a send that finds the bucket empty
+RATE_OVERFLOW_POLICIES = ('drop', 'coalesce')
+
+
+class RateLimit:
+    """Token bucket allowing `rate` sends per second with bursts of up to `burst`.
+
+    overflow says what the caller should do with a send that is refused:
+    'drop' discards it, 'coalesce' keeps only the latest refused message
+    and sends it once a token is available again.
+    """
+
+    __slots__ = ('rate', 'burst', 'overflow', '_tokens', '_updated', '_lock')
+
+    def __init__(self, rate, burst=1, overflow='drop'):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.overflow = overflow if overflow in RATE_OVERFLOW_POLICIES else 'drop'
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Pickled (in config snapshots) as its settings, with a full bucket
+        return (self.rate, self.burst, self.overflow)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def take(self):
+        """Take a token; returns 0.0 on success, else seconds until one is available"""
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if tokens >= 1.0:
+                self._tokens = tokens - 1.0
+                return 0.0
+            self._tokens = tokens
+            return (1.0 - tokens) / self.rate
+
+
+def make_rate_limit(settings):
+    """RateLimit from the rate_limit/rate_burst/rate_overflow keys of a mapping
+    or destination entry, or None when the rate is unset or not positive"""
+    try:
+        rate = float(settings.get('rate_limit') or 0)
+    except (TypeError, ValueError):
+        return None
+    if rate <= 0:
+        return None
+    try:
+        burst = float(settings.get('rate_burst') or 1)
+    except (TypeError, ValueError):
+        burst = 1.0
+    return RateLimit(rate, burst, settings.get('rate_overflow', 'drop'))
@@ -0,0 +1,220 @@
+"""Record MQTT traffic to a compact binary log and replay it through the bridge.
+
+File layout: the 8 byte MAGIC, then records. A record starts with its
+type byte:
+
+    TOPIC_RECORD    u32 topic id, u16 length, UTF-8 topic
+    MESSAGE_RECORD  u64 ns since the recording started, u32 topic id,
+                    u32 length, payload bytes
+
+Each topic is written once, before its first message, and referenced by
+id afterwards. The file is grown in chunks and written through mmap; a
+recording that was not closed cleanly ends in zero bytes, which readers
+treat as the end.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'MQUREC01'
+
+TOPIC_RECORD = 1
+MESSAGE_RECORD = 2
+
+_TOPIC = struct.Struct('<BIH')
+_MESSAGE = struct.Struct('<BQII')
+
+# Recording buffers: size of each, and how many may wait for the writer
+# before new messages are dropped instead of recorded
+BUFFER_SIZE = 1 << 20
+MAX_PENDING_BUFFERS = 16
+
+# Seconds between writer flushes of a partly filled buffer
+FLUSH_INTERVAL = 0.2
+
+# The file grows by at least this many bytes at a time
+FILE_CHUNK = 16 << 20
+
+
+class ReplayMessage:
+    """Stand-in for paho's MQTTMessage with the fields on_message reads"""
+
+    __slots__ = ('topic', 'payload', 'retain')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+        self.retain = False
+
+
+class Recorder:
+    """Appends messages to a recording file from the MQTT callback thread.
+
+    record() only packs into a preallocated buffer under a lock; full
+    buffers are written to the file by a background thread, which also
+    flushes a partly filled buffer every FLUSH_INTERVAL. When the writer
+    falls MAX_PENDING_BUFFERS behind, messages are counted as dropped.
+    """
+
+    def __init__(self, path, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.records = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self._topics = {}  # topic -> id
+        self._buffer = bytearray(buffer_size)
+        self._used = 0
+        self._full = []  # (buffer, used) waiting for the writer
+        self._spare = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+        self._start_ns = time.monotonic_ns()
+
+        self._file = open(path, 'w+b')
+        self._size = FILE_CHUNK
+        self._file.truncate(self._size)
+        self._map = mmap.mmap(self._file.fileno(), self._size)
+        self._map[:len(MAGIC)] = MAGIC
+        self._offset = len(MAGIC)
+        self._thread = threading.Thread(target=self._run, name='mqtt-recorder', daemon=True)
+        self._thread.start()
+
+    def record(self, topic, payload):
+        """Append one message; payload is the raw bytes as received"""
+        elapsed = time.monotonic_ns() - self._start_ns
+        with self._lock:
+            topic_id = self._topics.get(topic)
+            if topic_id is None:
+                encoded = topic.encode('utf-8')
+                topic_id = len(self._topics)
+                if not self._reserve(_TOPIC.size + len(encoded)):
+                    self.dropped += 1
+                    return
+                self._topics[topic] = topic_id
+                _TOPIC.pack_into(self._buffer, self._used, TOPIC_RECORD, topic_id, len(encoded))
+                end = self._used + _TOPIC.size + len(encoded)
+                self._buffer[self._used + _TOPIC.size:end] = encoded
+                self._used = end
+            if not self._reserve(_MESSAGE.size + len(payload)):
+                self.dropped += 1
+                return
+            _MESSAGE.pack_into(self._buffer, self._used, MESSAGE_RECORD, elapsed, topic_id, len(payload))
+            end = self._used + _MESSAGE.size + len(payload)
+            self._buffer[self._used + _MESSAGE.size:end] = payload
+            self._used = end
+            self.records += 1
+
+    def _reserve(self, size):
+        """Make room for size bytes in the current buffer; False when the writer is too far behind"""
+        if self._used + size <= len(self._buffer):
+            return True
+        if len(self._full) >= MAX_PENDING_BUFFERS:
+            return False
+        if self._used:
+            self._full.append((self._buffer, self._used))
+            self._wake.set()
+        # Oversized messages get a buffer of their own
+        if size > self.buffer_size:
+            self._buffer = bytearray(size)
+        else:
+            self._buffer = self._spare.pop() if self._spare else bytearray(self.buffer_size)
+        self._used = 0
+        return True
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            if self._used:
+                self._full.append((self._buffer, self._used))
+                self._buffer = self._spare.pop() if self._spare else bytearray(self.buffer_size)
+                self._used = 0
+            full, self._full = self._full, []
+        for buffer, used in full:
+            self._write(memoryview(buffer)[:used])
+            if len(buffer) == self.buffer_size:
+                with self._lock:
+                    self._spare.append(buffer)
+
+    def _write(self, data):
+        end = self._offset + len(data)
+        if end > self._size:
+            self._map.close()
+            self._size = max(end, self._size + FILE_CHUNK)
+            self._file.truncate(self._size)
+            self._map = mmap.mmap(self._file.fileno(), self._size)
+        self._map[self._offset:end] = data
+        self._offset = end
+        self.bytes_written = end
+
+    def close(self):
+        """Write everything recorded so far and trim the file to its contents"""
+        self._running = False
+        self._wake.set()
+        self._thread.join(2.0)
+        self._flush()
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(self._offset)
+        self._file.close()
+
+    def stats(self):
+        return {'records': self.records, 'dropped': self.dropped, 'topics': len(self._topics),
+                'bytes': self.bytes_written}
+
+
+def read_recording(path):
+    """Yield (ns since the recording started, topic, payload bytes) for each message"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(MAGIC):
+            raise ValueError(f"{path} is not a recording")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a recording")
+            topics = {}
+            offset = len(MAGIC)
+            size = len(data)
+            while offset < size:
+                kind = data[offset]
+                if kind == TOPIC_RECORD and offset + _TOPIC.size <= size:
+                    _, topic_id, length = _TOPIC.unpack_from(data, offset)
+                    offset += _TOPIC.size
+                    topics[topic_id] = data[offset:offset + length].decode('utf-8')
+                    offset += length
+                elif kind == MESSAGE_RECORD and offset + _MESSAGE.size <= size:
+                    _, elapsed, topic_id, length = _MESSAGE.unpack_from(data, offset)
+                    offset += _MESSAGE.size
+                    if offset + length > size:
+                        return  # Cut short
+                    yield elapsed, topics[topic_id], data[offset:offset + length]
+                    offset += length
+                else:
+                    return  # Zero padding of an unclosed recording, or cut short
+
+
+def replay(bridge, path, speed=1.0, stop=None):
+    """Feed a recording through bridge.on_message, returns the number of messages.
+
+    speed 1.0 keeps the recorded timing, 2.0 plays twice as fast and
+    0 as fast as possible. stop is an optional threading.Event.
+    """
+    count = 0
+    start = time.monotonic()
+    for elapsed, topic, payload in read_recording(path):
+        if stop is not None and stop.is_set():
+            break
+        if speed > 0:
+            wait = start + elapsed / 1e9 / speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        bridge.on_message(None, None, ReplayMessage(topic, payload))
+        count += 1
+    return count
@@ -0,0 +1,172 @@
+"""Destination address resolution with a TTL cache refreshed in the background"""
+import socket
+import threading
+import time
+
+# 'resolver' section of the mappings file, re-applied on reload
+DEFAULT_RESOLVER_SETTINGS = {
+    'ttl': 60.0,         # seconds a resolved hostname is used before it is refreshed
+    'retry': 5.0,        # seconds before a failed refresh is tried again
+    'hosts': {},         # hostname -> IP, takes precedence over DNS
+    'hosts_file': None,  # /etc/hosts style file of more overrides
+}
+
+
+def parse_hosts_file(path):
+    """{hostname: IP} from an /etc/hosts style file"""
+    hosts = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            for name in fields[1:]:
+                hosts.setdefault(name, fields[0])
+    return hosts
+
+
+def _numeric(host):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host.split('%', 1)[0])
+            return True
+        except OSError:
+            pass
+    return False
+
+
+def _lookup(host, port, flags=0):
+    family, _, _, _, sockaddr = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM, 0, flags)[0]
+    return family, sockaddr
+
+
+class Resolver:
+    """Resolves (host, port) to (family, sockaddr) once and keeps the result.
+
+    IP literals and hosts overrides never expire. Hostnames are looked up
+    on first use and then refreshed every ttl seconds by a background
+    thread, so sends never wait for DNS again. A failed refresh keeps the
+    last good address and is retried after `retry` seconds. A hostname that
+    fails its first lookup is not looked up again by the senders: its error
+    is raised from the cache while the background thread retries it every
+    `retry` seconds. When a refresh returns a new address on_change(key) is
+    called from that thread.
+    """
+
+    def __init__(self, ttl=60.0, retry=5.0, hosts=None, on_change=None, log=print):
+        self.ttl = float(ttl)
+        self.retry = float(retry)
+        self.hosts = dict(hosts or {})
+        self.on_change = on_change
+        self.log = log
+        self._entries = {}  # (host, port) -> [(family, sockaddr) or None, refresh due or None, lookup error]
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._running = True
+        self._thread = None
+        self.lookups = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def resolve(self, host, port):
+        """(family, sockaddr) for host:port; raises OSError if it was never resolved"""
+        key = (host, port)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] is None:
+                # Never resolved yet, the background thread is retrying. A fresh
+                # copy, as raising one instance again keeps growing its traceback
+                error = entry[2]
+                raise type(error)(*error.args)
+            return entry[0]
+
+        # First use, resolved on the calling thread
+        if host in self.hosts:
+            address, due = _lookup(self.hosts[host], port, socket.AI_NUMERICHOST), None
+        elif _numeric(host):
+            address, due = _lookup(host, port, socket.AI_NUMERICHOST), None
+        else:
+            self.lookups += 1
+            try:
+                address, due = _lookup(host, port), time.monotonic() + self.ttl
+            except OSError as e:
+                self.failures += 1
+                with self._lock:
+                    self._entries.setdefault(key, [None, time.monotonic() + self.retry, e])
+                    self._start()
+                raise
+        with self._lock:
+            self._entries[key] = [address, due, None]
+            if due is not None:
+                self._start()
+        return address
+
+    def set_hosts(self, hosts):
+        """Replace the hosts overrides; cached names they change are resolved again"""
+        with self._lock:
+            old, self.hosts = self.hosts, dict(hosts or {})
+            changed = [key for key in self._entries if old.get(key[0]) != self.hosts.get(key[0])]
+            for key in changed:
+                del self._entries[key]
+        if self.on_change:
+            for key in changed:
+                self.on_change(key)
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(1.0)
+
+    def stats(self):
+        return {'cached': len(self._entries), 'lookups': self.lookups, 'refreshes': self.refreshes,
+                'failures': self.failures, 'unresolved': sum(1 for entry in list(self._entries.values()) if entry[0] is None)}
+
+    def _start(self):
+        # Called with the lock held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='dns-refresh', daemon=True)
+            self._thread.start()
+        self._wake.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._running:
+                    now = time.monotonic()
+                    dues = {key: entry[1] for key, entry in self._entries.items() if entry[1] is not None}
+                    due = [key for key, when in dues.items() if when <= now]
+                    if due:
+                        break
+                    self._wake.wait(min(dues.values()) - now if dues else None)
+                if not self._running:
+                    return
+            for key in due:
+                self._refresh(key)
+
+    def _refresh(self, key):
+        host, port = key
+        self.refreshes += 1
+        try:
+            address = _lookup(host, port)
+        except OSError as e:
+            self.failures += 1
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry[1] = time.monotonic() + self.retry
+                    entry[2] = e
+            if entry is not None and entry[0] is not None:
+                self.log(f"⚠️ Could not refresh {host}: {str(e)}, still sending to {entry[0][1][0]}")
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return  # Dropped by set_hosts meanwhile
+            changed = entry[0] != address
+            entry[0] = address
+            entry[1] = time.monotonic() + self.ttl
+            entry[2] = None
+        if changed:
+            self.log(f"🔁 {host} now resolves to {address[1][0]}")
+            if self.on_change:
+                self.on_change(key)
@@ -0,0 +1,185 @@
+"""Retries of failed UDP sends and per-destination circuit breakers"""
+import errno
+import itertools
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+# 'retry' section of the mappings file (applied on startup). Retries are
+# enabled per mapping with retry_attempts / retry_backoff; breaker_failures
+# failures within breaker_reset seconds open a destination's circuit for as long
+DEFAULT_RETRY_SETTINGS = {'queue_size': 1000, 'overflow': 'drop_oldest', 'breaker_failures': 5, 'breaker_reset': 10.0}
+
+# Which retry is given up when the queue is full: the one waiting longest or the new one
+RETRY_OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest')
+
+# Upper bound (seconds) of the doubling backoff between attempts
+MAX_RETRY_BACKOFF = 5.0
+
+# Send errors that may clear up by themselves; anything else (a datagram
+# too large, a bad address) fails the same way every time
+RETRIABLE_ERRNOS = frozenset(code for code in (
+    getattr(errno, name, None) for name in ('ENOBUFS', 'EAGAIN', 'EWOULDBLOCK', 'ENETUNREACH', 'EHOSTUNREACH',
+                                            'ENETDOWN', 'EHOSTDOWN', 'ECONNREFUSED', 'EINTR')
+) if code is not None)
+
+
+def retriable(error):
+    """Whether a failed send is worth trying again"""
+    if isinstance(error, (socket.gaierror, TimeoutError)):
+        return True
+    return getattr(error, 'errno', None) in RETRIABLE_ERRNOS
+
+
+class RetryPolicy:
+    """Up to `attempts` retries, the first after `backoff` seconds and each later one after twice as long"""
+
+    __slots__ = ('attempts', 'backoff')
+
+    def __init__(self, attempts, backoff=0.1):
+        self.attempts = int(attempts)
+        self.backoff = max(0.0, float(backoff))
+
+    def delay(self, attempt):
+        """Seconds before retry number attempt (1-based)"""
+        return min(MAX_RETRY_BACKOFF, self.backoff * 2 ** (attempt - 1))
+
+
+def make_retry_policy(mapping):
+    """RetryPolicy from the retry_attempts/retry_backoff keys of a mapping, or None when retries are off"""
+    try:
+        attempts = int(mapping.get('retry_attempts') or 0)
+        backoff = float(mapping.get('retry_backoff', 0.1))
+    except (TypeError, ValueError):
+        return None
+    if attempts <= 0:
+        return None
+    return RetryPolicy(attempts, backoff)
+
+
+class RetryQueue:
+    """Failed sends waiting for their next attempt, at most max_size of them.
+
+    add() returns a sequence number for the entry; the caller schedules
+    take(seq) for when the attempt is due. An entry dropped on overflow or
+    by clear() is simply missing when its time comes.
+    """
+
+    def __init__(self, max_size=1000, overflow='drop_oldest'):
+        self.max_size = max(1, int(max_size))
+        self.overflow = overflow if overflow in RETRY_OVERFLOW_POLICIES else 'drop_oldest'
+        self._entries = OrderedDict()  # seq -> entry, oldest first
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def add(self, entry):
+        """Queue entry; returns (seq or None if it was refused, the entry dropped to make room or None)"""
+        evicted = None
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self.dropped += 1
+                if self.overflow == 'drop_newest':
+                    return None, None
+                _, evicted = self._entries.popitem(last=False)
+            seq = next(self._seq)
+            self._entries[seq] = entry
+        return seq, evicted
+
+    def take(self, seq):
+        with self._lock:
+            return self._entries.pop(seq, None)
+
+    def clear(self):
+        """Drop every queued retry, returns how many"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+        return count
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Breaker:
+    __slots__ = ('failures', 'window', 'opened', 'trial')
+
+    def __init__(self, now):
+        self.failures = 0
+        self.window = now  # monotonic time the current failure count started
+        self.opened = None  # monotonic time the circuit opened, None while closed
+        self.trial = None  # monotonic time a half-open trial send went out, None if none is out
+
+
+class CircuitBreakers:
+    """Failure-rate circuit breaker per destination.
+
+    After `threshold` failures within `reset` seconds a destination's
+    circuit opens and its sends are skipped for `reset` seconds; then one
+    trial send is let through, which closes the circuit on success or
+    opens it again. A trial that never reports back (the send was dropped
+    on the way) is given up after another `reset` seconds and a new one
+    let through.
+
+    Successes do not reset the count of a closed circuit: on a connected
+    UDP socket the ICMP error from one datagram is reported by the next
+    send, so a dead destination alternates between successes and
+    ECONNREFUSED. Fan-out sends use unconnected sockets, which never
+    report these errors, so only hard send failures count for them.
+    Destinations only get a breaker once a send to them fails, so healthy
+    ones cost a dict lookup. A threshold of 0 turns breaking off.
+    """
+
+    def __init__(self, threshold=5, reset=10.0):
+        self.threshold = int(threshold)
+        self.reset = float(reset)
+        self._breakers = {}  # destination -> _Breaker
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self._breakers)
+
+    def allow(self, destination):
+        """Whether a send to destination may go out now"""
+        breaker = self._breakers.get(destination)
+        if breaker is None or breaker.opened is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - (breaker.opened if breaker.trial is None else breaker.trial) < self.reset:
+                return False
+            breaker.trial = now
+            return True
+
+    def success(self, destination):
+        """A send went out: closes a half-open circuit, and forgets failures older than the window"""
+        breaker = self._breakers.get(destination)
+        if breaker is None:
+            return
+        with self._lock:
+            if breaker.trial is not None or (breaker.opened is None
+                                             and time.monotonic() - breaker.window >= self.reset):
+                self._breakers.pop(destination, None)
+
+    def failure(self, destination):
+        """Count a failed send, returns True if this opened the circuit"""
+        if self.threshold <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breakers.get(destination)
+            if breaker is None:
+                breaker = self._breakers[destination] = _Breaker(now)
+            elif breaker.opened is None and now - breaker.window >= self.reset:
+                breaker.failures = 0
+                breaker.window = now
+            breaker.failures += 1
+            if breaker.trial is not None or (breaker.opened is None and breaker.failures >= self.threshold):
+                breaker.trial = None
+                breaker.opened = now
+                return True
+            return False
+
+    def open_count(self):
+        return sum(1 for breaker in list(self._breakers.values()) if breaker.opened is not None)
@@ -0,0 +1,298 @@
+"""Sharded mode: the mapping table split over worker processes.
+
+Each worker owns the mappings whose topic filter hashes to it and runs a
+complete BridgeCore for them: its own MQTT connection and subscriptions,
+topic index, UDP sockets and sender threads. The broker delivers every
+message to each worker subscribed to a matching filter, so each mapping
+is still served exactly once, and routing spreads over as many cores as
+there are workers.
+
+The supervisor only collects logs and metrics from the workers over a
+pipe each and serves the merged metrics. Workers hot-reload the config
+file themselves; they never write it.
+
+Per-destination state lives in each worker. A destination rate limit is
+split evenly between the shards that have mappings sending to that
+destination, so together they stay within it; a shard with a burst of
+traffic cannot borrow the others' share. Circuit breakers are per worker
+too, each opening on the failures it sees itself.
+"""
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import threading
+import time
+import zlib
+
+from mqtt_udp_core import BridgeCore, DEFAULT_MAPPINGS_FILE, format_destinations, mapping_destinations, parse_destinations
+from mqtt_udp_metrics import DEFAULT_METRICS_SETTINGS, Metrics, MetricsServer
+
+# Seconds between worker reports (logs, metrics and stats) to the supervisor
+REPORT_INTERVAL = 0.5
+
+
+def shard_of(topic, shards):
+    """Index of the shard owning a mapping topic filter, stable across processes and runs"""
+    return zlib.crc32(topic.encode('utf-8')) % shards
+
+
+def split_destination_limits(limits, mappings, shards):
+    """Destination rate limits (destination_limits section) with each rate and
+    burst divided by the number of shards whose mappings send to that destination.
+
+    Returns (limits keyed by single destinations, {destination text: shard count} of the split ones).
+    """
+    senders = {}  # destination -> shards with mappings sending to it
+    for mapping in mappings:
+        shard = shard_of(mapping['topic'], shards)
+        for destination in mapping_destinations(mapping):
+            senders.setdefault(destination, set()).add(shard)
+
+    split, counts = {}, {}
+    for text, settings in limits.items():
+        try:
+            destinations = parse_destinations(text)
+        except ValueError:
+            split[text] = settings  # Reported by rebuild_destination_limits
+            continue
+        for destination in destinations:
+            key = format_destinations([destination])
+            count = len(senders.get(destination, ()))
+            entry = dict(settings)
+            if count > 1:
+                try:
+                    entry['rate_limit'] = float(settings.get('rate_limit') or 0) / count
+                    entry['rate_burst'] = max(1.0, float(settings.get('rate_burst') or 1) / count)
+                    counts[key] = count
+                except (TypeError, ValueError):
+                    pass  # Not a valid limit, make_rate_limit ignores it
+            split[key] = entry
+    return split, counts
+
+
+class ShardBridge(BridgeCore):
+    """BridgeCore routing only the mappings of one shard.
+
+    UDP ingress runs in shard 0 only, so each port is bound once, and
+    destination rate limits are divided between the shards sending to the
+    destination (see split_destination_limits).
+    """
+
+    def __init__(self, mappings_file, shard, shards):
+        self.shard = shard
+        self.shards = shards
+        super().__init__(mappings_file)
+
+    def load_mappings(self, rebuild_index=True):
+        # No compiled snapshot: the shards would share one file for different mappings
+        super().load_mappings(rebuild_index=False)
+        if rebuild_index:
+            self.rebuild_topic_index()
+
+    def read_config(self, data):
+        mappings, settings = super().read_config(data)
+        limits, counts = split_destination_limits(settings['destination_limit_settings'], mappings, self.shards)
+        settings['destination_limit_settings'] = limits
+        if counts and self.shard == 0:
+            print("Destination rate limits split between shards: "
+                  + ", ".join(f"{text} over {count}" for text, count in counts.items()))
+        mappings = [m for m in mappings if shard_of(m['topic'], self.shards) == self.shard]
+        if self.shard != 0:
+            settings['ingress_mappings'] = []
+        return mappings, settings
+
+    def client_id(self):
+        """A fixed client ID gets the shard number appended: the broker drops
+        the older of two connections with the same ID"""
+        client_id = super().client_id()
+        return f"{client_id}-{self.shard}" if client_id else client_id
+
+    def save_mappings(self):
+        """Workers hold part of the mappings, so only the supervisor's side edits the file"""
+        self.save_due = None
+
+    def report(self):
+        """Everything the supervisor needs from this worker, picklable"""
+        counters, histograms = self.metrics.snapshot()
+        return {
+            'shard': self.shard,
+            'pid': os.getpid(),
+            'logs': self.log_pipeline.drain(),
+            'counters': counters,
+            'histograms': histograms,
+            'mappings': len(self.udp_mappings),
+            'connected': self.connected,
+            'stats': self.stats(),
+        }
+
+
+def shard_main(mappings_file, shard, shards, conn, retry_interval=5.0):
+    """Worker process: run one shard until the supervisor says stop or goes away"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the supervisor
+    bridge = ShardBridge(mappings_file, shard, shards)
+    bridge.log_message(f"🧩 Shard {shard}/{shards} routing {len(bridge.udp_mappings)} mappings")
+
+    started = False
+    next_attempt = 0.0
+    running = True
+    while running:
+        if not started and time.monotonic() >= next_attempt:
+            started = bridge.connect_mqtt()
+            next_attempt = time.monotonic() + retry_interval
+        try:
+            while conn.poll(REPORT_INTERVAL):
+                command, value = conn.recv()
+                if command == 'stop':
+                    running = False
+                    break
+                if command == 'udp_enabled':
+                    bridge.set_udp_enabled(value)
+                if command == 'profile':
+                    base, ext = os.path.splitext(value)
+                    bridge.capture_profile(path=f"{base}_shard{shard}{ext}")
+            bridge.poll_config()
+            conn.send(bridge.report())
+        except (EOFError, OSError):
+            break  # Supervisor gone
+
+    bridge.shutdown()
+    try:
+        conn.send(bridge.report())
+    except (EOFError, OSError):
+        pass
+    conn.close()
+
+
+class ShardSupervisor:
+    """Starts the worker processes and merges what they report"""
+
+    def __init__(self, mappings_file, shards):
+        context = multiprocessing.get_context('spawn')  # no inherited threads or sockets
+        self.shards = shards
+        self.workers = {}  # shard -> (process, connection)
+        self.reports = {}  # shard -> latest report
+        self.metrics = Metrics()
+        self.stopping = False
+        for shard in range(shards):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=shard_main, args=(mappings_file, shard, shards, child_conn),
+                                      name=f"mqtt-udp-shard-{shard}", daemon=True)
+            process.start()
+            child_conn.close()
+            self.workers[shard] = (process, parent_conn)
+
+    def poll(self, timeout=0.2):
+        """Collect pending reports, returns their log lines prefixed with the shard"""
+        lines = []
+        connections = {conn: shard for shard, (_, conn) in self.workers.items() if not conn.closed}
+        for conn in multiprocessing.connection.wait(list(connections), timeout):
+            shard = connections[conn]
+            try:
+                while conn.poll():
+                    report = conn.recv()
+                    self.reports[shard] = report
+                    lines.extend(f"[{shard}] {line}" for line in report['logs'])
+            except (EOFError, OSError):
+                conn.close()
+                process = self.workers[shard][0]
+                process.join(0.1)
+                if self.stopping:
+                    lines.append(f"⏹️ Shard {shard} stopped")
+                else:
+                    lines.append(f"💥 Shard {shard} exited (code {process.exitcode})")
+        return lines
+
+    def send(self, command, value=None):
+        for _, conn in self.workers.values():
+            if not conn.closed:
+                try:
+                    conn.send((command, value))
+                except (EOFError, OSError):
+                    pass
+
+    def set_udp_enabled(self, enabled):
+        self.send('udp_enabled', enabled)
+
+    def capture_profile(self, path):
+        """Have every worker write a profile, to path with the shard number added"""
+        self.send('profile', path)
+
+    def alive(self):
+        return sum(1 for process, _ in self.workers.values() if process.is_alive())
+
+    def render_metrics(self):
+        """Merged worker metrics in Prometheus text format"""
+        reports = list(self.reports.values())
+        self.metrics.load_snapshots((r['counters'], r['histograms']) for r in reports)
+
+        def total(key, field):
+            return sum(r['stats'][key][field] for r in reports)
+
+        gauges = {
+            'shards': ("Worker processes running", self.alive()),
+            'mappings': ("Configured mappings", sum(r['mappings'] for r in reports)),
+            'connected': ("Workers connected to the broker", sum(int(r['connected']) for r in reports)),
+            'send_queue_depth': ("Sends waiting for a sender thread", total('queue', 'depth')),
+            'send_queue_dropped': ("Sends dropped by the queue overflow policy", total('queue', 'dropped')),
+            'delayed_pending': ("Delayed sends waiting to fire", total('delayed', 'pending')),
+            'sockets_open': ("Pooled UDP sockets", total('sender', 'sockets_open')),
+        }
+        return self.metrics.render_prometheus(gauges)
+
+    def stop(self, timeout=5.0):
+        self.stopping = True
+        self.send('stop')
+        deadline = time.monotonic() + timeout
+        lines = []
+        while any(process.is_alive() for process, _ in self.workers.values()) and time.monotonic() < deadline:
+            lines.extend(self.poll(0.1))
+        lines.extend(self.poll(0))
+        for process, conn in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+            process.join(1.0)
+            conn.close()
+        return lines
+
+
+def run_sharded(mappings_file=DEFAULT_MAPPINGS_FILE, shards=2):
+    """Headless mode with routing split over shards worker processes"""
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+
+    supervisor = ShardSupervisor(mappings_file, shards)
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <pid> captures a profile in every worker
+        directory = os.path.dirname(os.path.abspath(mappings_file))
+        signal.signal(signal.SIGUSR1, lambda signum, frame: supervisor.capture_profile(
+            os.path.join(directory, f"mqtt_udp_profile_{time.strftime('%Y%m%d_%H%M%S')}.folded")))
+    print(f"Running headless with {shards} shards, config {mappings_file}")
+
+    metrics_settings = dict(DEFAULT_METRICS_SETTINGS)
+    try:
+        with open(mappings_file) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            metrics_settings.update(data.get('metrics', {}))
+    except (OSError, ValueError):
+        pass
+    metrics_server = None
+    if metrics_settings.get('enabled'):
+        try:
+            metrics_server = MetricsServer(supervisor.render_metrics, metrics_settings['address'], int(metrics_settings['port']))
+            print(f"📈 Metrics at {metrics_server.url}")
+        except (OSError, ValueError) as e:
+            print(f"❌ Could not start metrics endpoint: {str(e)}")
+
+    while not stop.is_set() and supervisor.alive():
+        for line in supervisor.poll(0.2):
+            print(line, flush=True)
+
+    for line in supervisor.stop():
+        print(line)
+    if metrics_server:
+        metrics_server.stop()
+    return 0
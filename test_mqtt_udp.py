@@ -0,0 +1,321 @@
+"""Tests for the MQTT to UDP bridge core (run with: python -m pytest test_mqtt_udp.py)"""
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import mqtt_udp_resolver
+from mqtt_udp_retry import CircuitBreakers
+from mqtt_udp_shards import shard_of, split_destination_limits
+from mqtt_udp_core import (BridgeCore, compile_trigger, filter_covers, PayloadView, SubscriptionManager, TriggerPredicate,
+                           UDPSender, VALUE_KEYS)
+
+
+def reference_should_trigger(payload, trigger_value):
+    """The original per-mapping should_trigger, kept to pin down the compiled predicates"""
+    if trigger_value == '':
+        return True
+    if payload.strip() == trigger_value:
+        return True
+    try:
+        data = json.loads(payload)
+        if isinstance(data, (str, int, float)):
+            return str(data) == trigger_value
+        if isinstance(data, dict):
+            if "Val" in data:
+                return str(data["Val"]) == trigger_value
+            for key in ['value', 'val', 'state', 'status', 'data']:
+                if key in data:
+                    return str(data[key]) == trigger_value
+            for value in data.values():
+                if str(value) == trigger_value:
+                    return True
+    except (json.JSONDecodeError, TypeError):
+        pass
+    try:
+        return float(payload.strip()) == float(trigger_value)
+    except (ValueError, TypeError):
+        pass
+    return False
+
+
+def matches(payload, trigger_value):
+    return compile_trigger(trigger_value).matches(PayloadView(payload))
+
+
+PAYLOADS = [
+    '', ' ', 'ON', ' ON ', 'on', 'OFF', '1', ' 1 ', '1.0', '01', '1e0', '-0', '0', 'nan', 'inf',
+    'true', 'false', 'null', '"ON"', '"1"', '1.5', 'abc def',
+    '[1, 2]', '["ON"]', '[]', '{}',
+    '{"Val": 1}', '{"Val": "ON"}', '{"Val": true}', '{"Val": null}', '{"Val": 1, "value": 2}',
+    '{"value": 2, "state": "ON"}', '{"state": "ON", "value": 3}', '{"status": "OFF"}', '{"data": [1]}',
+    '{"val": 1.0}', '{"other": "ON", "x": 1}', '{"a": {"b": 1}}', '{"a": null}', '{"a": true}',
+    '{"Val": 1', 'ON}',
+]
+
+TRIGGERS = ['', 'ON', 'OFF', '1', '1.0', '2', '3', 'True', 'true', 'None', 'null', '[1, 2]', '[1]',
+            "{'b': 1}", 'nan', '0', '-0', ' ON', 'abc def']
+
+
+class TriggerMatrixTest(unittest.TestCase):
+    """Every payload x trigger pair matches exactly as the original should_trigger did"""
+
+    def test_matches_reference(self):
+        for payload in PAYLOADS:
+            for trigger in TRIGGERS:
+                with self.subTest(payload=payload, trigger=trigger):
+                    self.assertEqual(matches(payload, trigger), reference_should_trigger(payload, trigger))
+
+    def test_matches_reference_from_bytes(self):
+        for payload in PAYLOADS:
+            for trigger in TRIGGERS:
+                with self.subTest(payload=payload, trigger=trigger):
+                    view = PayloadView(data=payload.encode('utf-8'))
+                    self.assertEqual(compile_trigger(trigger).matches(view), reference_should_trigger(payload, trigger))
+
+    def test_view_shared_between_triggers(self):
+        # One view per message is reused by every mapping; cached forms must not leak between triggers
+        for payload in PAYLOADS:
+            view = PayloadView(payload)
+            for trigger in TRIGGERS:
+                with self.subTest(payload=payload, trigger=trigger):
+                    self.assertEqual(compile_trigger(trigger).matches(view), reference_should_trigger(payload, trigger))
+
+
+class TriggerRulesTest(unittest.TestCase):
+
+    def test_empty_trigger_matches_anything(self):
+        self.assertTrue(matches('', ''))
+        self.assertTrue(matches('{"Val": 0}', ''))
+
+    def test_exact_match_of_stripped_payload(self):
+        self.assertTrue(matches('  ON\n', 'ON'))
+        self.assertFalse(matches('on', 'ON'))
+
+    def test_json_scalar_compared_as_text(self):
+        self.assertTrue(matches('"ON"', 'ON'))
+        self.assertTrue(matches('true', 'true'))
+        self.assertTrue(matches('true', 'True'))  # bool is an int, so str(True) is compared too
+        self.assertFalse(matches('"1"', '1.0'))
+
+    def test_json_scalar_returns_early(self):
+        # A JSON number only matches its str(); the numeric fallback is not reached
+        self.assertFalse(matches('1', '1.0'))
+        self.assertFalse(matches('1.0', '1'))
+        self.assertTrue(matches('01', '1'))  # not JSON, so compared as numbers
+
+    def test_val_field_first(self):
+        self.assertTrue(matches('{"Val": 1, "value": 2}', '1'))
+        self.assertFalse(matches('{"Val": 1, "value": 2}', '2'))
+
+    def test_value_keys_in_order(self):
+        self.assertEqual(VALUE_KEYS, ('value', 'val', 'state', 'status', 'data'))
+        self.assertTrue(matches('{"state": "ON", "value": 3}', '3'))
+        self.assertFalse(matches('{"state": "ON", "value": 3}', 'ON'))
+        self.assertTrue(matches('{"status": "OFF"}', 'OFF'))
+
+    def test_any_value_fallback(self):
+        self.assertTrue(matches('{"other": "ON", "x": 1}', 'ON'))
+        self.assertTrue(matches('{"other": "ON", "x": 1}', '1'))
+        self.assertTrue(matches('{"a": null}', 'None'))
+        self.assertFalse(matches('{"other": "ON"}', 'OFF'))
+
+    def test_numeric_fallback(self):
+        self.assertTrue(matches(' 01 ', '1'))
+        self.assertTrue(matches('1e0', '1.0'))
+        self.assertFalse(matches('ON', '1'))
+
+    def test_lists_and_null(self):
+        self.assertFalse(matches('[1, 2]', '1'))
+        self.assertTrue(matches('[1, 2]', '[1, 2]'))  # exact text match still applies
+        self.assertFalse(matches('null', 'None'))
+        self.assertTrue(matches('null', 'null'))
+
+    def test_compiled_predicates_are_shared(self):
+        self.assertIs(compile_trigger('ON'), compile_trigger('ON'))
+        self.assertIsInstance(compile_trigger('ON'), TriggerPredicate)
+
+
+class PayloadViewTest(unittest.TestCase):
+
+    def test_forms_from_text_and_bytes(self):
+        view = PayloadView(' 42 ')
+        self.assertEqual(view.stripped, '42')
+        self.assertEqual(view.number, 42.0)
+        self.assertEqual(view.data, b' 42 ')
+        self.assertEqual(PayloadView(data=b'{"Val": 3}').json_values, (True, '3'))
+
+    def test_non_json_and_non_numeric(self):
+        view = PayloadView('hello')
+        self.assertIsNone(view.json_values)
+        self.assertIsNone(view.number)
+
+    def test_binary_payload(self):
+        view = PayloadView(data=b'\xff\x00')
+        self.assertFalse(compile_trigger('ON').matches(view))
+        self.assertTrue(view.binary)
+        self.assertEqual(view.data, b'\xff\x00')
+        self.assertEqual(view.last_value, b'\xff\x00')
+
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def subscribe(self, topics):
+        self.calls.append(('subscribe', topics))
+
+    def unsubscribe(self, topics):
+        self.calls.append(('unsubscribe', topics))
+
+
+class SubscriptionManagerTest(unittest.TestCase):
+
+    def test_subscribes_before_unsubscribing(self):
+        manager, client = SubscriptionManager(), RecordingClient()
+        manager.sync(client, {'a/#': 0})
+        client.calls.clear()
+        manager.sync(client, {'a/+': 0})
+        self.assertEqual(client.calls, [('subscribe', [('a/+', 0)]), ('unsubscribe', ['a/#'])])
+
+    def test_share_group_change_overlaps(self):
+        manager, client = SubscriptionManager(), RecordingClient()
+        manager.configure('one')
+        manager.sync(client, {'a/b': 1})
+        client.calls.clear()
+        manager.configure('two')
+        manager.sync(client, {'a/b': 1})
+        self.assertEqual(client.calls, [('subscribe', [('$share/two/a/b', 1)]), ('unsubscribe', ['$share/one/a/b'])])
+
+    def test_reduce_matches_pairwise_check(self):
+        rng = random.Random(2)
+        for _ in range(200):
+            topics = {}
+            for _ in range(40):
+                levels = [rng.choice(['a', 'b', '+', 'c', '$s']) for _ in range(rng.randint(1, 4))]
+                if rng.random() < 0.3:
+                    levels.append('#')
+                topics['/'.join(levels)] = rng.randint(0, 2)
+            expected = {topic: qos for topic, qos in topics.items()
+                        if not any(wide != topic and topics[wide] >= qos and filter_covers(wide, topic) for wide in topics)}
+            self.assertEqual(SubscriptionManager.reduce(topics), expected)
+
+    def test_reduce_scales_with_many_wildcards(self):
+        # Pairwise covering checks took seconds here; the trie walk takes milliseconds
+        topics = {f"site{i % 50}/+/dev{i}/#": 0 for i in range(3000)}
+        topics.update({f"site{i % 50}/+/dev{i}/state": 0 for i in range(3000)})
+        topics.update({f"site{i % 50}/x/dev{i}/state": 0 for i in range(17000)})
+        started = time.perf_counter()
+        reduced = SubscriptionManager.reduce(topics)
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(len(reduced), 3000 + 14000)
+
+
+
+class ResolverTest(unittest.TestCase):
+
+    def test_failed_first_lookup_is_cached(self):
+        lookup = mock.Mock(side_effect=socket.gaierror(-2, 'Name or service not known'))
+        with mock.patch.object(mqtt_udp_resolver, '_lookup', lookup):
+            resolver = mqtt_udp_resolver.Resolver(retry=60.0)
+            try:
+                for _ in range(3):
+                    with self.assertRaises(socket.gaierror):
+                        resolver.resolve('dead.example', 9)
+                self.assertEqual(lookup.call_count, 1)
+                self.assertEqual(resolver.stats()['unresolved'], 1)
+            finally:
+                resolver.stop()
+
+
+    def test_slow_lookup_does_not_block_other_sends(self):
+        release = threading.Event()
+        real_lookup = mqtt_udp_resolver._lookup
+
+        def lookup(host, port, flags=0):
+            if host == 'slow.example':
+                release.wait(5)
+                raise socket.gaierror(-3, 'Temporary failure in name resolution')
+            return real_lookup(host, port, flags)
+
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(2)
+        sender = UDPSender()
+        with mock.patch.object(mqtt_udp_resolver, '_lookup', lookup):
+            slow = threading.Thread(target=lambda: self.assertRaises(OSError, sender.send, 'slow.example', 9, b'x'))
+            slow.start()
+            try:
+                time.sleep(0.05)
+                started = time.monotonic()
+                sender.send('127.0.0.1', receiver.getsockname()[1], b'fast')
+                self.assertLess(time.monotonic() - started, 1.0)
+                self.assertEqual(receiver.recv(16), b'fast')
+            finally:
+                release.set()
+                slow.join()
+                sender.close()
+                sender.resolver.stop()
+                receiver.close()
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_successes_between_failures_do_not_reset(self):
+        breakers = CircuitBreakers(threshold=3, reset=60.0)
+        opened = []
+        for _ in range(3):
+            breakers.success('dest')
+            opened.append(breakers.failure('dest'))
+        self.assertEqual(opened, [False, False, True])
+        self.assertFalse(breakers.allow('dest'))
+
+    def test_opens_for_closed_local_port(self):
+        # The port is bound and closed again, so sends to it get ICMP port unreachable
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        config = {'broker': {'address': 'localhost', 'port': 1883, 'auto_connect': False},
+                  'metrics': {'enabled': False}, 'retry': {'breaker_failures': 3, 'breaker_reset': 60.0},
+                  'mappings': [{'topic': 'a', 'udp_ip': '127.0.0.1', 'udp_port': port, 'udp_message': 'x'}]}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'mappings.json')
+            with open(path, 'w') as f:
+                json.dump(config, f)
+            bridge = BridgeCore(path)
+            try:
+                route = bridge.routes[id(bridge.udp_mappings[0])]
+                for _ in range(40):
+                    bridge.send_rendered(route, PayloadView('x'), b'x', route.destinations)
+                    time.sleep(0.005)
+                self.assertEqual(bridge.breakers.open_count(), 1)
+                self.assertGreater(bridge.metrics.totals()[0]['circuit_open'], 0)
+            finally:
+                bridge.shutdown()
+
+
+
+class ShardLimitsTest(unittest.TestCase):
+
+    def test_destination_limit_split_between_sending_shards(self):
+        mappings = [{'topic': f"t{i}", 'udp_ip': '10.0.0.1', 'udp_port': 5000, 'udp_message': 'x'} for i in range(8)]
+        mappings.append({'topic': 'solo', 'udp_ip': '10.0.0.2', 'udp_port': 5000, 'udp_message': 'x'})
+        sending = len({shard_of(m['topic'], 3) for m in mappings[:8]})
+        limits = {'10.0.0.1:5000, 10.0.0.2:5000': {'rate_limit': 12, 'rate_burst': 6}}
+
+        split, counts = split_destination_limits(limits, mappings, 3)
+        self.assertEqual(split['10.0.0.1:5000']['rate_limit'], 12 / sending)
+        self.assertEqual(split['10.0.0.1:5000']['rate_burst'], max(1.0, 6 / sending))
+        self.assertEqual(split['10.0.0.2:5000'], {'rate_limit': 12, 'rate_burst': 6})
+        self.assertEqual(counts, {'10.0.0.1:5000': sending} if sending > 1 else {})
+
+
+if __name__ == '__main__':
+    unittest.main()